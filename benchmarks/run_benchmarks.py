@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+r"""
+Benchmarks for the coset, poset and subsystem computations of uhw_modules.
+
+Every case runs in a fresh Sage process, so that caches of one case do not
+influence another one and the peak memory of the case can be recorded. The
+results are written as JSON, which makes it easy to compare two versions::
+
+    $ sage -python benchmarks/run_benchmarks.py --output before.json
+    $ sage -python benchmarks/run_benchmarks.py --types A4,E6 --repeat 3
+
+Times are wall clock seconds of the benchmarked call only (the Weyl group
+and the pair are constructed before). The peak memory is the maximal
+resident set size of the process in kilobytes, ``baseline_kb`` is the
+resident set size before the call.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+DEFAULT_TYPES = ["A3", "A4", "A5", "B3", "B4", "C3", "C4", "D4", "D5", "E6", "E7"]
+
+# benchmarks depending on the Levi part run for every Hermitian symmetric index set
+LEVI_BENCHMARKS = ["minimal_representatives", "parabolic_poset", "parabolic_weight_poset",
+                   "get_generating_roots", "get_subsystem_data"]
+TYPE_BENCHMARKS = ["root_system_facets"]
+
+
+def cases(types, benchmarks):
+    from uhw_modules import hermitian_symmetric_index_sets
+    for cartan_type in types:
+        for name in benchmarks:
+            if name in TYPE_BENCHMARKS:
+                yield {"benchmark": name, "cartan_type": cartan_type, "index_set": None}
+            else:
+                for index_set in hermitian_symmetric_index_sets([cartan_type[0], int(cartan_type[1:])]):
+                    yield {"benchmark": name, "cartan_type": cartan_type, "index_set": index_set}
+
+
+def setup_case(case):
+    """
+    Returns a function without arguments which runs the benchmark ``case`` and a function which resets the caches.
+    """
+    from sage.combinat.root_system.weyl_group import WeylGroup
+    from uhw_modules import HermitianSymmetricPair, RootSystemFacets, parabolic_orbit_cache
+
+    cartan_type = [case["cartan_type"][0], int(case["cartan_type"][1:])]
+    name, index_set = case["benchmark"], case["index_set"]
+    W = WeylGroup(cartan_type)
+    L = W.domain()
+
+    if name == "root_system_facets":
+        return lambda: RootSystemFacets(cartan_type)._get_fan(), lambda: None
+    if name in ("get_generating_roots", "get_subsystem_data"):
+        P = HermitianSymmetricPair(cartan_type, index_set)
+        method = getattr(P, name)
+        return lambda: method(L.zero()), P._subsystem_data_cache.clear
+
+    def reset():
+        parabolic_orbit_cache.clear(disk=False)
+    if name == "minimal_representatives":
+        return lambda: W.minimal_representatives(index_set), reset
+    if name == "parabolic_poset":
+        return lambda: W.parabolic_poset(index_set), reset
+    if name == "parabolic_weight_poset":
+        return lambda: W.parabolic_weight_poset(L.zero(), index_set), reset
+    raise ValueError("unknown benchmark %s" % name)
+
+
+def run_case(case, repeat):
+    """
+    Runs ``case`` in the current process and returns the measurements.
+    """
+    run, reset = setup_case(case)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times = []
+    for _ in range(repeat):
+        reset()
+        start = time.time()
+        run()
+        times.append(time.time() - start)
+    result = dict(case)
+    result.update({"times": times,
+                   "best": min(times),
+                   "baseline_kb": baseline,
+                   "peak_memory_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+    return result
+
+
+def run_in_subprocess(case, repeat, timeout):
+    command = [sys.executable, os.path.abspath(__file__), "--case", json.dumps(case), "--repeat", str(repeat)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    timer = threading.Timer(timeout, process.kill) if timeout else None
+    if timer is not None:
+        timer.start()
+    try:
+        out, err = process.communicate()
+    finally:
+        if timer is not None:
+            timer.cancel()
+    if process.returncode == 0:
+        return json.loads(out.splitlines()[-1])
+    result = dict(case)
+    result["error"] = "timeout" if process.returncode < 0 else (err.strip().splitlines() or ["failed"])[-1]
+    return result
+
+
+def metadata():
+    from sage.version import version
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"sage_version": version,
+            "python_version": platform.python_version(),
+            "machine": platform.node(),
+            "commit": commit,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--types", default=",".join(DEFAULT_TYPES),
+                        help="comma separated Cartan types, e.g. A4,D5,E6")
+    parser.add_argument("--benchmarks", default=",".join(LEVI_BENCHMARKS + TYPE_BENCHMARKS),
+                        help="comma separated names of benchmarks")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=3600, help="seconds per case, 0 for no limit")
+    parser.add_argument("--output", help="file for the JSON results, standard output by default")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # the disk cache of parabolic orbits would turn the coset benchmarks into file reads
+    os.environ["UHW_MODULES_CACHE_DIR"] = ""
+
+    if args.case is not None:
+        print(json.dumps(run_case(json.loads(args.case), args.repeat)))
+        return
+
+    results = []
+    for case in cases(args.types.split(","), args.benchmarks.split(",")):
+        result = run_in_subprocess(case, args.repeat, args.timeout)
+        sys.stderr.write("%(benchmark)s %(cartan_type)s %(index_set)s: " % case +
+                         ("%.3f s, %d kB\n" % (result["best"], result["peak_memory_kb"])
+                          if "error" not in result else "%s\n" % result["error"]))
+        results.append(result)
+
+    report = json.dumps({"metadata": metadata(), "results": results}, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
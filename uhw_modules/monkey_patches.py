@@ -3,70 +3,805 @@
 ##############  Parabolic enhancements for Weyl groups  ##############
 ######################################################################
 
+import hashlib
+import logging
+import os
+import tempfile
+import zipfile
+from collections import OrderedDict
+from copy import copy
+
 import sage.combinat.root_system.weyl_group as wg
+from sage.combinat.posets.posets import Poset
+from sage.graphs.digraph import DiGraph
+from uhw_utils import canonical_simple_roots, integral_array, root_lattice_to_ambient
+
+logger = logging.getLogger(__name__)
+
+
+class CartanData(object):
+    r"""
+    Integer data of a finite root system used by the orbit engines below.
+
+    Weights are plain tuples of integers in the basis of fundamental weights,
+    indexed by the positions of the nodes in ``index_set``. The coordinates of
+    the simple roots in this basis are the entries of the Cartan matrix, so a
+    simple reflection only needs a handful of integer operations.
+
+    - ``simple_roots[p]`` -- the simple root of the node at position ``p``
+    - ``positive_roots`` -- positive roots in the basis of fundamental weights
+    - ``positive_root_coefficients`` -- the same roots in the basis of simple roots
+    - ``positive_coroots`` -- the associated coroots in the basis of simple coroots
+    - ``ambient_positive_roots`` -- the same roots in the ambient space
+    - ``root_index`` -- dictionary mapping the positive roots to their positions
+
+    EXAMPLES::
+
+        sage: D = cartan_data(CartanType(['B', 2]))
+        sage: D.simple_roots
+        ((2, -2), (-1, 2))
+        sage: len(D.positive_roots)
+        4
+    """
+    def __init__(self, cartan_type):
+        from sage.combinat.root_system.root_system import RootSystem
+
+        root_system = RootSystem(cartan_type)
+        weight_space = root_system.weight_space()
+        self.cartan_type = cartan_type
+        self.index_set = tuple(root_system.index_set())
+        self.rank = len(self.index_set)
+        self.position = dict((i, p) for (p, i) in enumerate(self.index_set))
+        self.simple_roots = tuple(tuple(int(weight_space.simple_root(i).coefficient(j)) for j in self.index_set)
+                                  for i in self.index_set)
+        # nonzero entries of the simple roots, i.e. the neighbours in the Dynkin diagram
+        self.simple_root_support = tuple(tuple((q, a) for (q, a) in enumerate(alpha) if a)
+                                         for alpha in self.simple_roots)
+        self.positive_roots = []
+        self.positive_root_coefficients = []
+        self.positive_coroots = []
+        self.ambient_positive_roots = []
+        for r in root_system.root_lattice().positive_roots():
+            coefficients = tuple(int(r.coefficient(i)) for i in self.index_set)
+            coroot = r.associated_coroot()
+            self.positive_root_coefficients.append(coefficients)
+            self.positive_roots.append(tuple(sum(c * alpha[q] for (c, alpha) in zip(coefficients, self.simple_roots))
+                                             for q in range(self.rank)))
+            self.positive_coroots.append(tuple(int(coroot.coefficient(i)) for i in self.index_set))
+            self.ambient_positive_roots.append(r.to_ambient())
+        self.root_index = dict((root, k) for (k, root) in enumerate(self.positive_roots))
+        self.ambient_root_index = dict((root, k) for (k, root) in enumerate(self.ambient_positive_roots))
+
+    def simple_reflection(self, vec, p):
+        """
+        Apply the simple reflection of the node at position ``p`` to the weight ``vec``.
+        """
+        c = vec[p]
+        new_vec = list(vec)
+        for (q, a) in self.simple_root_support[p]:
+            new_vec[q] -= c * a
+        return tuple(new_vec)
+
+    def reflection(self, vec, k):
+        """
+        Apply the reflection of the ``k``-th positive root to the weight ``vec``.
+        """
+        n = sum(c * x for (c, x) in zip(self.positive_coroots[k], vec))
+        return tuple(x - n * a for (x, a) in zip(vec, self.positive_roots[k]))
+
+
+def cartan_data(cartan_type):
+    """
+    Returns the (cached) ``CartanData`` of ``cartan_type``.
+    """
+    if cartan_type not in _cartan_data_cache:
+        _cartan_data_cache[cartan_type] = CartanData(cartan_type)
+    return _cartan_data_cache[cartan_type]
+
+_cartan_data_cache = {}
+
+
+def _orbit_levels(data, index_set, relative_index_set, max_length=None):
+    """
+    Generator of the levels of the orbit of the characteristic vector.
+
+    Each level is a list of triples ``(vec, parent, p)`` where ``parent`` is the
+    position of the parent in the previous level and ``p`` the position of the
+    node whose simple reflection maps the parent to ``vec``. All paths to a
+    vector have the same length, so only the current level has to be kept.
+    """
+    allowed = [data.position[i] for i in relative_index_set]
+    # the characteristic vector
+    rhop = tuple(int(i in relative_index_set and i not in index_set) for i in data.index_set)
+    level = [(rhop, -1, -1)]
+    length = 0
+    while level:
+        yield level
+        if length == max_length:
+            return
+        length += 1
+        seen = set()
+        next_level = []
+        for (k, (vec, parent, letter)) in enumerate(level):
+            for p in allowed:
+                if vec[p] > 0:
+                    new_vec = data.simple_reflection(vec, p)
+                    if new_vec not in seen:
+                        seen.add(new_vec)
+                        next_level.append((new_vec, k, p))
+        level = next_level
+
+def _levi_index_sets(nodes, index_set, relative_index_set):
+    """
+    Returns ``index_set`` and ``relative_index_set`` as lists ordered as ``nodes``.
+    """
+    if index_set is None:
+        index_set = []
+    if not relative_index_set:
+        relative_index_set = nodes
+    # TODO check for relative_index_set being a superset of index_set
+    return [i for i in nodes if i in index_set], [i for i in nodes if i in relative_index_set]
+
+
+class ParabolicOrbit(object):
+    r"""
+    The orbit of the characteristic weight `\rho_P` of a parabolic subalgebra.
+
+    The weight `\rho_P` is the sum of the fundamental weights of the crossed
+    nodes and its stabilizer is the parabolic subgroup `W_P`, so the orbit is
+    in bijection with the minimal coset representatives `W^P`. Traversing the
+    orbit by simple reflections `s_i` with `\langle \mu, \alpha_i^\vee \rangle > 0`
+    raises the length by one, so the path to each node is a reduced word of
+    the corresponding representative. See Cap, Slovak: Parabolic geometries,
+    p. 332.
+
+    The weights are integer tuples in the basis of fundamental weights (see
+    ``CartanData``) and the reduced words are stored as parent pointers: node
+    ``k`` is obtained from node ``parents[k]`` by the simple reflection of
+    the node at position ``letters[k]``.
+
+    The cover relations of the Bruhat order on `W^P` are read off the orbit
+    as well: `\mu` covers `s_\beta \mu` iff `\langle \mu, \beta^\vee \rangle < 0`
+    and the length of `s_\beta \mu` is one less than the length of `\mu`.
+    Hence no generic Bruhat order machinery is needed.
+
+    Nodes are numbered in the order of traversal, i.e. by increasing length.
+    If ``max_length`` is given, only the nodes up to that length are computed.
+
+    EXAMPLES::
+
+        sage: W = WeylGroup(['A', 3], prefix="s")
+        sage: O = ParabolicOrbit(W, [1, 3])
+        sage: len(O), O.lengths
+        (6, [0, 1, 2, 2, 3, 4])
+        sage: O.vectors[:3]
+        [(0, 1, 0), (1, -1, 1), (-1, 0, 1)]
+        sage: O.reduced_word(5)
+        [2, 1, 3, 2]
+        sage: len(O.cover_relations())
+        6
+    """
+    def __init__(self, weyl_group, index_set=None, relative_index_set=None, max_length=None):
+        self._setup(weyl_group, index_set, relative_index_set)
+        data = self.cartan_data
+
+        self.vectors = []
+        self.parents = []
+        self.letters = []
+        self.lengths = []
+        self._index = {}
+        start = 0
+        for (length, level) in enumerate(_orbit_levels(data, self.index_set, self.relative_index_set, max_length)):
+            previous, start = start, len(self.vectors)
+            for (vec, parent, p) in level:
+                self._index[vec] = len(self.vectors)
+                self.vectors.append(vec)
+                self.parents.append(previous + parent if parent >= 0 else -1)
+                self.letters.append(p)
+                self.lengths.append(length)
+
+    def _setup(self, weyl_group, index_set, relative_index_set):
+        self.weyl_group = weyl_group
+        self.cartan_data = data = cartan_data(weyl_group.cartan_type())
+        self.index_set, self.relative_index_set = _levi_index_sets(data.index_set, index_set, relative_index_set)
+        allowed = [data.position[i] for i in self.relative_index_set]
+        self._covers = None
+        self._cache = None
+        self._matrices = None
+        self._supports = None
+
+        # roots of the Levi part of the relative parabolic together with their coroots
+        self._roots = [(root, tuple((q, c) for (q, c) in enumerate(coroot) if c))
+                       for (root, coefficients, coroot) in zip(data.positive_roots,
+                                                               data.positive_root_coefficients,
+                                                               data.positive_coroots)
+                       if all(q in allowed for (q, c) in enumerate(coefficients) if c)]
+
+    @classmethod
+    def from_arrays(cls, weyl_group, index_set, relative_index_set, arrays):
+        """
+        Reconstruct the orbit from the output of ``self.to_arrays()``.
+        """
+        orbit = cls.__new__(cls)
+        orbit._setup(weyl_group, index_set, relative_index_set)
+        orbit.vectors = [tuple(vec) for vec in arrays['vectors'].tolist()]
+        orbit.parents = arrays['parents'].tolist()
+        orbit.letters = arrays['letters'].tolist()
+        orbit.lengths = arrays['lengths'].tolist()
+        orbit._index = dict((vec, k) for (k, vec) in enumerate(orbit.vectors))
+        if arrays['has_covers']:
+            orbit._covers = [tuple(edge) for edge in arrays['covers'].tolist()]
+        return orbit
+
+    def to_arrays(self):
+        """
+        Return the orbit vectors, parent pointers, letters, lengths and (if
+        already computed) cover relations of ``self`` as NumPy arrays.
+        """
+        import numpy as np
+        covers = self._covers if self._covers is not None else []
+        return {'vectors': np.array(self.vectors, dtype=np.int16).reshape(len(self), self.cartan_data.rank),
+                'parents': np.array(self.parents, dtype=np.int32),
+                'letters': np.array(self.letters, dtype=np.int8),
+                'lengths': np.array(self.lengths, dtype=np.int16),
+                'covers': np.array(covers, dtype=np.int32).reshape(len(covers), 2),
+                'has_covers': np.array(self._covers is not None)}
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def reduced_word(self, k):
+        """
+        Return the path of simple reflections from the characteristic vector to node ``k``.
+        """
+        word = []
+        while k > 0:
+            word.append(self.cartan_data.index_set[self.letters[k]])
+            k = self.parents[k]
+        return word[::-1]
+
+    def cover_relations(self):
+        """
+        Return the cover relations of the Bruhat order on ``self`` as pairs
+        ``(i, j)`` of node numbers, node ``j`` covering node ``i``.
+
+        Only the roots with negative pairing are tried, so the cost is linear
+        in the size of the orbit. The result is remembered and, if ``self``
+        comes from a ``ParabolicOrbitCache``, stored with it.
+        """
+        if self._covers is not None:
+            return self._covers
+        covers = []
+        for j, vec in enumerate(self.vectors):
+            length = self.lengths[j] - 1
+            for root, coroot in self._roots:
+                n = sum(c * vec[q] for (q, c) in coroot)
+                if n < 0:
+                    i = self._index[tuple(x - n * a for (x, a) in zip(vec, root))]
+                    if self.lengths[i] == length:
+                        covers.append((i, j))
+        self._covers = covers
+        if self._cache is not None:
+            self._cache.store(self)
+        return covers
+
+    def elements(self, side="right"):
+        """
+        Return the minimal coset representatives as a list indexed by the node
+        numbers. See ``WeylGroup_gens.minimal_representatives`` for ``side``.
+
+        Each element is obtained from its parent by a single multiplication by
+        a simple reflection.
+        """
+        if side != 'right' and side != 'left':
+            raise ValueError, "%s is neither 'right' nor 'left'" % side
+        W = self.weyl_group
+        s = [W.simple_reflection(i) for i in self.cartan_data.index_set]
+        elements = [W.one()]
+        for k in range(1, len(self.vectors)):
+            if side == 'left':
+                elements.append(elements[self.parents[k]] * s[self.letters[k]])
+            else:
+                # here the reduced words are reversed
+                elements.append(s[self.letters[k]] * elements[self.parents[k]])
+        return elements
+
+    def matrices(self, side="right"):
+        """
+        Return the matrices of ``self.elements(side)`` acting on the basis of
+        fundamental weights, stacked into an integer array of shape ``(len(self), rank, rank)``.
+
+        Each matrix is obtained from the matrix of the parent by changing one
+        column (``side='left'``) or subtracting one outer product (``side='right'``).
+        The result is remembered.
+        """
+        import numpy as np
+        if side != 'right' and side != 'left':
+            raise ValueError, "%s is neither 'right' nor 'left'" % side
+        if self._matrices is None:
+            self._matrices = {}
+        if side not in self._matrices:
+            data = self.cartan_data
+            alpha = np.array(data.simple_roots, dtype=np.int64).reshape(data.rank, data.rank)
+            M = np.empty((len(self), data.rank, data.rank), dtype=np.int64)
+            M[0] = np.identity(data.rank, dtype=np.int64)
+            for k in range(1, len(self)):
+                parent, p = M[self.parents[k]], self.letters[k]
+                # the matrix of s_p is the identity minus alpha_p in the p-th column
+                if side == 'left':
+                    M[k] = parent
+                    M[k, :, p] -= np.dot(parent, alpha[p])
+                else:
+                    M[k] = parent - np.outer(alpha[p], parent[p])
+            self._matrices[side] = M
+        return self._matrices[side]
+
+    def action(self, vectors, side="right"):
+        """
+        Apply all elements of ``self.elements(side)`` to each of the ``vectors``.
+
+        The vectors are the rows of an array in the basis of fundamental weights.
+        Returns an array of shape ``(len(vectors), len(self), rank)``. For
+        ``side='right'`` the element of a node is a simple reflection times the
+        element of its parent, so the images are computed along the parent
+        pointers, one level and one simple reflection at a time. For
+        ``side='left'`` the matrices of ``self.matrices`` are used.
+        """
+        import numpy as np
+        if side != 'right' and side != 'left':
+            raise ValueError, "%s is neither 'right' nor 'left'" % side
+        data = self.cartan_data
+        vectors = np.asarray(vectors).reshape(-1, data.rank)
+        if side == 'left':
+            return np.einsum('kij,mj->mki', self.matrices('left'), vectors)
+
+        alpha = np.array(data.simple_roots, dtype=np.int64).reshape(data.rank, data.rank)
+        parents = np.array(self.parents, dtype=np.int64)
+        letters = np.array(self.letters, dtype=np.int64)
+        lengths = np.array(self.lengths, dtype=np.int64)
+        images = np.empty((len(vectors), len(self), data.rank), dtype=vectors.dtype)
+        images[:, 0] = vectors
+        starts = list(np.flatnonzero(np.diff(lengths)) + 1) + [len(self)]
+        for (a, b) in zip(starts, starts[1:]):
+            for p in set(self.letters[a:b]):
+                nodes = a + np.flatnonzero(letters[a:b] == p)
+                previous = images[:, parents[nodes]]
+                images[:, nodes] = previous - previous[:, :, p, None] * alpha[p]
+        return images
+
+    def dot_action(self, weights, side="right"):
+        r"""
+        Apply the dot action `w \cdot \lambda = w(\lambda + \rho) - \rho` of all
+        elements of ``self.elements(side)`` to each of the ``weights``.
+
+        The weights are the rows of an array in the basis of fundamental weights,
+        the result has shape ``(len(weights), len(self), rank)``, see ``action``.
+
+        EXAMPLES::
+
+            sage: W = WeylGroup(['A', 2])
+            sage: O = W.parabolic_orbit([1])
+            sage: O.dot_action([[0, 0], [1, 0]]).tolist()
+            [[[0, 0], [1, -2], [-3, 0]], [[1, 0], [2, -2], [-4, 1]]]
+        """
+        import numpy as np
+        weights = np.asarray(weights)
+        return self.action(weights + 1, side) - 1
+
+    def supports(self):
+        """
+        Return the supports of the elements as bitmasks over the positions of the nodes.
+        The support of a node is the support of its parent and its letter.
+        """
+        if self._supports is None:
+            supports = [0]
+            for k in range(1, len(self)):
+                supports.append(supports[self.parents[k]] | (1 << self.letters[k]))
+            self._supports = supports
+        return self._supports
+
+    def relative_nodes(self, index_set, relative_index_set):
+        r"""
+        Return the node numbers of the minimal coset representatives of
+        `W_I \backslash W_J` for ``I = index_set`` and ``J = relative_index_set``.
+
+        Here ``self.index_set`` has to be a subset of ``index_set``, so that these
+        representatives are among the nodes of ``self``. A node belongs to
+        `W_J` iff its support is in ``J`` and its ``'left'`` element `w` is a
+        minimal representative for `W_I` iff `w(\rho)` is `I`-dominant, which
+        is read off the matrices of ``self.matrices('left')``.
+        """
+        import numpy as np
+        data = self.cartan_data
+        if not set(self.index_set).issubset(index_set) or not set(index_set).issubset(relative_index_set) \
+                or not set(relative_index_set).issubset(self.relative_index_set):
+            raise ValueError("the index sets %s, %s and %s do not form a chain"
+                             % (self.index_set, index_set, relative_index_set))
+        mask = sum(1 << data.position[i] for i in relative_index_set)
+        positions = [data.position[i] for i in index_set]
+        # w(rho) for rho = (1, ..., 1)
+        rho_images = self.matrices('left').sum(axis=2)
+        dominant = (rho_images[:, positions] > 0).all(axis=1).tolist()
+        return [k for (k, support) in enumerate(self.supports()) if support & ~mask == 0 and dominant[k]]
+
+    def poset_data(self, side="right"):
+        """
+        Return the elements and the cover relations in the form accepted by ``Poset``.
+        """
+        elements = self.elements(side)
+        covers = tuple([elements[i], elements[j]] for (i, j) in self.cover_relations())
+        return elements, covers
+
+
+class ParabolicOrbitCache(object):
+    r"""
+    Cache of ``ParabolicOrbit`` keyed by the Cartan type and the Levi index sets.
+
+    The orbits depend only on ``(cartan_type, index_set, relative_index_set)``;
+    the side only affects how the stored words are read, so it is not part of
+    the key. Orbits are kept in an in-process LRU cache holding at most
+    ``maxsize`` of them. If ``directory`` is given, the orbit vectors, reduced
+    words (as parent pointers), lengths and Hasse edges are also stored there
+    as compressed NumPy files named by a hash of the key, so that later
+    sessions can load them instead of traversing the orbit again.
+
+    The module level instance ``parabolic_orbit_cache`` stores its files in the
+    directory given by the environment variable ``UHW_MODULES_CACHE_DIR``, by
+    default in ``$DOT_SAGE/uhw_modules``. Set the variable to an empty string
+    to disable the on-disk layer.
+
+    EXAMPLES::
+
+        sage: cache = ParabolicOrbitCache(tmp_dir(), maxsize=2)
+        sage: W = WeylGroup(['E', 6])
+        sage: O = cache.get(W, [1, 2, 3, 4, 5])
+        sage: _ = O.cover_relations()
+        sage: cache.clear(disk=False)
+        sage: P = cache.get(W, [1, 2, 3, 4, 5])
+        sage: P is O, P.vectors == O.vectors, P.cover_relations() == O.cover_relations()
+        (False, True, True)
+    """
+    format_version = 1
+
+    def __init__(self, directory=None, maxsize=32):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._orbits = OrderedDict()
+
+    def key(self, orbit):
+        """
+        Return the key of ``orbit``.
+        """
+        return (str(orbit.cartan_data.cartan_type), tuple(orbit.index_set), tuple(orbit.relative_index_set))
+
+    def filename(self, key):
+        """
+        Return the name of the file storing the orbit with the given ``key``.
+        """
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + ".npz")
+
+    def get(self, weyl_group, index_set=None, relative_index_set=None):
+        """
+        Return the orbit of the characteristic vector, loading or computing it if necessary.
+        """
+        data = cartan_data(weyl_group.cartan_type())
+        index_set, relative_index_set = _levi_index_sets(data.index_set, index_set, relative_index_set)
+        key = (str(data.cartan_type), tuple(index_set), tuple(relative_index_set))
+        orbit = self._orbits.pop(key, None)
+        if orbit is None:
+            orbit = self._load(key, weyl_group, index_set, relative_index_set)
+        if orbit is None:
+            orbit = ParabolicOrbit(weyl_group, index_set, relative_index_set)
+            orbit._cache = self
+            self.store(orbit)
+        self._orbits[key] = orbit
+        while len(self._orbits) > self.maxsize:
+            self._orbits.popitem(last=False)
+        if orbit.weyl_group is not weyl_group:
+            # the same orbit for another realization of the Weyl group
+            orbit = copy(orbit)
+            orbit.weyl_group = weyl_group
+        return orbit
+
+    def store(self, orbit):
+        """
+        Write ``orbit`` to the cache directory (if any).
+
+        The file is written under a temporary name and renamed afterwards, so
+        concurrent sessions never see a partially written file. If the directory
+        is not writable (or full), the orbit is only kept in memory.
+        """
+        import numpy as np
+        key = self.key(orbit)
+        if key in self._orbits and orbit._covers is not None:
+            self._orbits[key]._covers = orbit._covers
+        if not self.directory:
+            return
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:  # created in the meantime by another process, or not writable
+                pass
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, key=np.array(repr(key)), format=np.array(self.format_version),
+                                    **orbit.to_arrays())
+            os.rename(tmp, self.filename(key))
+        except (OSError, IOError) as error:
+            logger.debug("Could not store the orbit %s: %s", key, error)
+            if tmp is not None and os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+    def _load(self, key, weyl_group, index_set, relative_index_set):
+        import numpy as np
+        if not self.directory:
+            return None
+        filename = self.filename(key)
+        if not os.path.exists(filename):
+            return None
+        try:
+            with np.load(filename) as arrays:
+                if int(arrays['format']) != self.format_version or str(arrays['key']) != repr(key):
+                    return None
+                orbit = ParabolicOrbit.from_arrays(weyl_group, index_set, relative_index_set, arrays)
+        except (IOError, KeyError, ValueError, zipfile.BadZipfile):
+            return None
+        orbit._cache = self
+        return orbit
+
+    def clear(self, disk=True):
+        """
+        Empty the in-process cache and, if ``disk`` is ``True``, remove the stored files.
+        """
+        self._orbits.clear()
+        if disk and self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(".npz"):
+                    os.remove(os.path.join(self.directory, name))
+
+
+def _default_cache_directory():
+    directory = os.environ.get('UHW_MODULES_CACHE_DIR')
+    if directory is None:
+        from sage.env import DOT_SAGE
+        directory = os.path.join(DOT_SAGE, 'uhw_modules')
+    return directory
+
+parabolic_orbit_cache = ParabolicOrbitCache(_default_cache_directory())
+
+
+def parabolic_orbit(self, index_set=None, relative_index_set=None, max_length=None):
+    """
+    Returns the orbit of the characteristic weight of the parabolic subgroup given by ``index_set``.
+
+    See ``ParabolicOrbit``. Complete orbits are taken from ``parabolic_orbit_cache``.
+    """
+    if max_length is None:
+        return parabolic_orbit_cache.get(self, index_set, relative_index_set)
+    return ParabolicOrbit(self, index_set, relative_index_set, max_length)
+
+def iter_minimal_representatives(self, index_set=None, side="right", relative_index_set=None,
+                                 max_length=None, reduced_words=False):
+    """
+    Iterates over the minimal coset representatives of ``self`` by a parabolic subgroup in order of increasing length.
+
+    The orbit of the characteristic vector is traversed lazily and only one
+    level of it is kept in memory, so it is cheap to stop early.
+
+    INPUT:
+
+    - ``index_set``, ``side``, ``relative_index_set`` - see ``self.minimal_representatives``
+    - ``max_length`` - if given, stop after the representatives of this length
+    - ``reduced_words`` - if ``True``, yield reduced words (lists of nodes) instead of group elements
+
+    EXAMPLES::
+
+        sage: W = WeylGroup(['E', 8], prefix="s")
+        sage: list(W.iter_minimal_representatives([1,2,3,4,5,6,7], side="left", max_length=3, reduced_words=True))
+        [[], [8], [8, 7], [8, 7, 6]]
+        sage: G = WeylGroup(CartanType("A4"),prefix="s")
+        sage: set(G.iter_minimal_representatives([1,3,4])) == G.minimal_representatives([1,3,4])
+        True
+    """
+    if side != 'right' and side != 'left':
+        raise ValueError, "%s is neither 'right' nor 'left'" % side
+
+    data = cartan_data(self.cartan_type())
+    index_set, relative_index_set = _levi_index_sets(data.index_set, index_set, relative_index_set)
+    if reduced_words:
+        previous = [()]
+        s = [(i,) for i in data.index_set]
+    else:
+        previous = [self.one()]
+        s = [self.simple_reflection(i) for i in data.index_set]
+    for level in _orbit_levels(data, index_set, relative_index_set, max_length):
+        current = []
+        for (vec, parent, p) in level:
+            if parent < 0:
+                w = previous[0]
+            elif side == 'left':
+                w = previous[parent] + s[p] if reduced_words else previous[parent] * s[p]
+            else:
+                # the reduced words are reversed
+                w = s[p] + previous[parent] if reduced_words else s[p] * previous[parent]
+            current.append(w)
+            yield list(w) if reduced_words else w
+        previous = current
+
+def _weight_labels(orbit, weight, index_set, side):
+    """
+    Return the labels ``str(((weight + rho).weyl_action(x) - rho).to_dominant_chamber(index_set).to_vector())``
+    for the elements ``x`` of ``orbit.elements(side)``, computed with ``orbit.dot_action``.
+    """
+    from sage.matrix.constructor import matrix
+    from sage.rings.rational_field import QQ
+
+    L = weight.parent()
+    data = orbit.cartan_data
+    coordinates, d = integral_array([[L.simple_root(i).associated_coroot().scalar(weight) for i in data.index_set]])
+    # the dot action of the scaled weight, rho is scaled as well
+    images = orbit.action(coordinates + d, side)[0] - d
+    if index_set is None:
+        index_set = data.index_set
+    positions = [data.position[i] for i in index_set]
+
+    differences = []
+    for y in images.tolist():
+        p = next((p for p in positions if y[p] < 0), None)
+        while p is not None:
+            y = data.simple_reflection(y, p)
+            p = next((p for p in positions if y[p] < 0), None)
+        differences.append([a - b for (a, b) in zip(y, coordinates[0].tolist())])
+    # the labels differ from the weight by elements of the root lattice, which keeps
+    # the components of the ambient space orthogonal to the roots (e.g. in type A)
+    ambient = matrix(QQ, differences) * root_lattice_to_ambient(L) / d
+    vec = weight.to_vector()
+    return [str(vec + row) for row in ambient.rows()]
+
+class ParabolicGraph(object):
+    """
+    The Hasse diagram of the Bruhat order on the minimal coset representatives with integer vertices.
+
+    The vertices are the node numbers ``0, ..., n-1`` of a ``ParabolicOrbit``
+    and the edges ``i -> j`` (``j`` covers ``i``) are stored in compressed sparse
+    row form: the successors of ``i`` are ``indices[indptr[i]:indptr[i+1]]``.
+    The labels (group elements, or weights if ``weight`` is given) are only
+    computed when a ``DiGraph`` or its LaTeX code is requested.
+
+    EXAMPLES::
+
+        sage: W = WeylGroup(['A', 3], prefix="s")
+        sage: G = W.parabolic_graph([1, 3])
+        sage: G.num_vertices(), G.num_edges()
+        (6, 6)
+        sage: G.indptr.tolist(), G.indices.tolist()
+        ([0, 1, 3, 4, 5, 6, 6], [1, 2, 3, 4, 4, 5])
+        sage: G.to_digraph().num_verts()
+        6
+    """
+    def __init__(self, orbit, side="right", weight=None, index_set=None):
+        import numpy as np
+        self.orbit = orbit
+        self.side = side
+        self.weight = weight
+        self.index_set = index_set
+        edges = np.array(orbit.cover_relations(), dtype=np.int64).reshape(-1, 2)
+        edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+        self.indices = edges[:, 1]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(edges[:, 0], minlength=len(orbit)))])
+        self._labels = None
+
+    def num_vertices(self):
+        return len(self.orbit)
+
+    def num_edges(self):
+        return len(self.indices)
+
+    def successors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def edges(self):
+        """
+        Iterate over the edges ``(i, j)``, ``j`` covering ``i``.
+        """
+        for i in range(self.num_vertices()):
+            for j in self.successors(i).tolist():
+                yield i, j
+
+    def labels(self):
+        """
+        Return the list of vertex labels: the elements of ``self.orbit.elements(self.side)``,
+        or the strings of the weights in the orbit of ``self.weight`` (see ``parabolic_weight_graph``).
+        """
+        if self._labels is None:
+            if self.weight is None:
+                self._labels = self.orbit.elements(self.side)
+            else:
+                self._labels = _weight_labels(self.orbit, self.weight, self.index_set, self.side)
+        return self._labels
+
+    def to_digraph(self, enumerate_vertices=False):
+        """
+        Return the diagram as a ``DiGraph`` with labels as vertices.
+
+        Without a weight the edges are labeled by ``v.inverse()*u`` as in ``parabolic_bruhat_graph``.
+        If ``enumerate_vertices`` is true, the vertices are the strings ``"i:label"``.
+        """
+        labels = self.labels()
+        if enumerate_vertices:
+            labels = ["%d:%s" % (i, label) for (i, label) in enumerate(labels)]
+        res = DiGraph()
+        for (i, j) in self.edges():
+            u, v = labels[i], labels[j]
+            if self.weight is None and not enumerate_vertices:
+                res.add_edge(u, v, v.inverse()*u)
+            else:
+                res.add_edge(u, v)
+        return res
+
+    def _latex_(self):
+        from sage.misc.latex import latex
+        return latex(self.to_digraph())
+
+def parabolic_graph(self, index_set=None, side="right", weight=None):
+    """
+    Returns the Hasse diagram of the Bruhat order on minimal coset representatives as a ``ParabolicGraph``.
+    """
+    if side != 'right' and side != 'left':
+        raise ValueError, "%s is neither 'right' nor 'left'" % side
+    return ParabolicGraph(self.parabolic_orbit(index_set), side, weight, index_set)
 
 def parabolic_bruhat_graph(self, index_set = None, side="right"):
     """
     Returns the Hasse graph of the poset ``self.bruhat_poset(index_set,side)`` with edges labeled by the cover relation
     """
-    elements = self.minimal_representatives(index_set, side)
-    covers =[(x,y)  for y in elements for x in y.bruhat_lower_covers() if x in elements]
-    res = DiGraph()
-    for u,v in covers:
-        res.add_edge(u,v,v.inverse()*u)
-    return res
+    return self.parabolic_graph(index_set, side).to_digraph()
 
 def parabolic_weight_graph(self, weight, index_set=None,side="right"):
-    elements = self.minimal_representatives(index_set,side)
     #wl0 = self.long_element(index_set)
     #covers =[(wl0*x,wl0*y)  for y in elements for x in y.bruhat_lower_covers() if x in elements] # funguje jen pro "right"
-    covers =[(x,y)  for y in elements for x in y.bruhat_lower_covers() if x in elements]
-    res = DiGraph()
-    rho = weight.parent().rho()
-    v = weight + rho
-    def act_on_weight(v,x):
-        return str((v.weyl_action(x) - rho).to_dominant_chamber(index_set).to_vector())
-    for x,y in covers:
-        #a = v.weyl_action(x) - rho
-        #b = v.weyl_action(y) - rho
-        #res.add_edge(str(a.to_vector()),str(b.to_vector()))
-        a = act_on_weight(v,x)
-        b = act_on_weight(v,y)
-        res.add_edge(a,b)
-    return res
+    # the vertices are the labels, so the elements themselves are not needed
+    return self.parabolic_graph(index_set, side, weight).to_digraph()
 
 def parabolic_weight_graph_enum(self, weight, index_set=None, side="right"):
-    elements = [x for x in enumerate(self.minimal_representatives(index_set,side))]
-    covers =[(x,y)  for y in elements for x in elements if x[1] in y[1].bruhat_lower_covers()]
-    res = DiGraph()
-    rho = weight.parent().rho()
-    v = weight + rho
-    def act_on_weight(v,x):
-        return str((v.weyl_action(x) - rho).to_dominant_chamber(index_set).to_vector())
-    for x,y in covers:
-        a = str(x[0]) + ":" + act_on_weight(v,x[1])
-        b = str(y[0]) + ":" + act_on_weight(v,y[1])
-        res.add_edge(a,b)
-    return res
+    # the vertices are numbered by the orbit, the cover relations come from the orbit as well
+    return self.parabolic_graph(index_set, side, weight).to_digraph(enumerate_vertices=True)
 
 def parabolic_poset(self, levi_indices, side="right"):
     # returns a poset of minimal representatives of W_S \ W
     # self is a finite-dimensional Weyl group
     # first we compute orbit of the characteristic vector of our parabolic subalgebra
     # this is for representatives of left cosets; to obtain representatives for right cosets just take the inverse
-    elements = self.minimal_representatives(levi_indices, side)
-    #since our Weyl elements should be already reduced (?), we could optimize this step by constructing the cover relations directly thus reducing quadratic complexity to linear
-    covers = tuple([x,y]  for y in elements for x in y.bruhat_lower_covers() if x in elements)
+    # the cover relations are read off the orbit directly, see ParabolicOrbit
+    elements, covers = self.parabolic_orbit(levi_indices).poset_data(side)
     return Poset( (elements, covers), cover_relations = True)
 
 def parabolic_weight_poset(self, weight, levi_indices, side="right", relative_index_set=None):
-    rho = weight.parent().rho()
-    v = weight + rho
-    elements = self.minimal_representatives(levi_indices, side, relative_index_set=relative_index_set)
-    covers = tuple([x,y]  for y in elements for x in y.bruhat_lower_covers() if x in elements)
-    labels = {}
-    for x in elements:
-        labels[x] = str((v.weyl_action(x) - rho).to_dominant_chamber(levi_indices).to_vector())
+    """
+    Returns the poset of minimal coset representatives labeled by the weights
+    ``((weight + rho).weyl_action(x) - rho).to_dominant_chamber(levi_indices)``.
+
+    EXAMPLES::
+
+        sage: W = WeylGroup(['A', 2], prefix="s")
+        sage: L = W.domain()
+        sage: rho = L.rho()
+        sage: P = W.parabolic_weight_poset(L.zero(), [1])
+        sage: labels = [str((rho.weyl_action(x) - rho).to_dominant_chamber([1]).to_vector())
+        ....:           for x in W.minimal_representatives([1])]
+        sage: sorted(str(x) for x in P) == sorted(labels)
+        True
+        sage: '(0, -1, 1)' in labels
+        True
+    """
+    orbit = self.parabolic_orbit(levi_indices, relative_index_set)
+    elements, covers = orbit.poset_data(side)
+    labels = dict(zip(elements, _weight_labels(orbit, weight, levi_indices, side)))
     return Poset( (elements, covers), cover_relations = True, element_labels=labels)
 
 def minimal_representatives(self, index_set=None, side="right", relative_index_set=None):
@@ -96,71 +831,152 @@ def minimal_representatives(self, index_set=None, side="right", relative_index_s
         sage: print a.difference(b)
         set([])
     """
-    from sage.combinat.root_system.root_system import RootSystem
-    from copy import copy
-
     if side != 'right' and side != 'left':
         raise ValueError, "%s is neither 'right' nor 'left'" % side
 
-   #TODO check for relative_index_set being a superset of index_set
+    # The orbit of the characteristic vector is traversed on integer tuples, see ParabolicOrbit.
+    return set(self.parabolic_orbit(index_set, relative_index_set).elements(side))
 
-    weight_space = RootSystem(self.cartan_type()).weight_space()
-    if index_set is None:
-        crossed_nodes = set(self.index_set())
-        relative_crossed_nodes = set()
-    else:
-        crossed_nodes = set(self.index_set()).difference(index_set)
-        if not relative_index_set:
-            relative_index_set = self.index_set()
-        relative_crossed_nodes = set(self.index_set()).difference(relative_index_set)
-    # the characteristic vector
-    rhop = sum([weight_space.fundamental_weight(i) for i in crossed_nodes if not(i in relative_crossed_nodes)])
-    '''
-
-    The variable "todo" serves for traversing the orbit of rhop, while the directory "known" serves
-elements in the orbit of rhop while known[vec] are paths of simple reflections from rhop to vec.
-
-    '''
-    todo = [rhop]
-    known = dict()
-    known[rhop] = []
-    if rhop == 0:
-        return {self.one()}
-    else:
-        while len(todo) > 0:
-            vec = todo.pop()
-            nonzero_coeffs = [i for i in self.index_set() if (vec.coefficient(i) > 0) and (i in relative_index_set)]
-            for i in nonzero_coeffs:
-                new_vec = vec.simple_reflection(i)
-                new_reflections = copy(known[vec])
-                new_reflections.append(i)
-                todo.append(new_vec)
-                known[new_vec] = new_reflections
-        if side =='left':
-            return set(self.from_reduced_word(w) for w in known.values())
+def bruhat_poset(self, index_set = None, side="right", facade = False):
+    # The cover relations are constructed directly from the orbit of the
+    # characteristic vector (see Cap, Slovak: Parabolic geometries), so the
+    # complexity is linear in the number of minimal representatives.
+    elements, covers = self.parabolic_orbit(index_set).poset_data(side)
+    return Poset((elements, covers), cover_relations = True, facade=facade)
+
+class ReflectionSubgroup(object):
+    r"""
+    The reflection subgroup `W'` of a Weyl group `W` generated by the reflections `s_\beta`, `\beta` in ``generators``.
+
+    The root subsystem `\Phi'` of `W'` is the closure of the generating roots
+    under the generating reflections. Its canonical simple roots with respect
+    to `\Phi' \cap \Phi^+` are the positive roots of `\Phi'` which are not a
+    sum of two other positive roots of `\Phi'`; their reflections are the
+    canonical Coxeter generators of `W'` (see [Deodhar] or [Dyer]). The
+    elements are enumerated by traversing the (regular) orbit of `\rho`
+    under `W'`: the generator `s_\beta` raises the length in `W'` of `w`
+    iff `\langle w(\rho), \beta^\vee \rangle > 0`.
+
+    Roots are kept as positions in the list of positive roots of
+    ``cartan_data(W.cartan_type())``. If the list ``reflections`` of the
+    reflections in these roots is given, the generators are given by such
+    positions as well (see ``ParabolicPair.reflection_subgroup``), which
+    avoids looking up the roots of the reflections. The attributes are
+
+    - ``positive_roots``, ``simple_roots`` -- roots of `\Phi'` in the domain of `W`
+    - ``elements`` -- the elements of `W'` (as elements of `W`) in order of increasing length in `W'`
+    - ``lengths`` -- the lengths of ``elements`` with respect to the canonical generators
+    - ``rho_images`` -- the weights `w(\rho)` as integer tuples in the basis of fundamental weights
+
+    EXAMPLES::
+
+        sage: W = WeylGroup(['B', 2], prefix="s")
+        sage: e = W.domain().basis()
+        sage: H = W.reflection_subgroup([e[0] + e[1], e[0] - e[1]])
+        sage: H.positive_roots
+        [(1, -1), (1, 1)]
+        sage: len(H), H.lengths
+        (4, [0, 1, 1, 2])
+        sage: W.one() in H, W.simple_reflection(2) in H
+        (True, False)
+    """
+    def __init__(self, weyl_group, generators, reflections=None):
+        self.weyl_group = weyl_group
+        self.cartan_data = data = cartan_data(weyl_group.cartan_type())
+        if reflections is None:
+            family = weyl_group.reflections()
+            roots = family.inverse_family()
+            generators = [roots[g] if g.parent() is weyl_group else g for g in generators]
+            generators = [data.ambient_root_index[r] if r in data.ambient_root_index else data.ambient_root_index[-r]
+                          for r in generators]
         else:
-            #here we could just take the inverses of w but reversing the list of simple reflections
-            return set(self.from_reduced_word(w[::-1]) for w in known.values())
+            # the generators are already positions in the list of positive roots
+            generators = list(generators)
 
-def bruhat_poset(self, index_set = None, side="right", facade = False):
-    from sage.combinat.posets.posets import Poset
-    elements = self.minimal_representatives(index_set, side)
-    # Since our Weyl elements should be already reduced (?), we could
-    # optimize this step by constructing the cover relations directly (see Cap, Slovak: Parabolic
-    # thus reducing quadratic complexity of the next step to linear. On the other hand, we would
-    covers = tuple([x,y] for y in elements for x in  y.bruhat_lower_covers()
-                    if x in elements)
-    return Poset((self, covers), cover_relations = True, facade=facade)
+        # close the generating roots under the generating reflections
+        positive = set(generators)
+        todo = list(generators)
+        while todo:
+            vec = data.positive_roots[todo.pop()]
+            for k in generators:
+                new_vec = data.reflection(vec, k)
+                j = data.root_index.get(new_vec)
+                if j is None:
+                    j = data.root_index[tuple(-x for x in new_vec)]
+                if j not in positive:
+                    positive.add(j)
+                    todo.append(j)
+        self.positive_root_indices = sorted(positive)
+        self.simple_root_indices = [data.root_index[root] for root in
+                                    canonical_simple_roots([data.positive_roots[k] for k in self.positive_root_indices])]
+        self.positive_roots = [data.ambient_positive_roots[k] for k in self.positive_root_indices]
+        self.simple_roots = [data.ambient_positive_roots[k] for k in self.simple_root_indices]
+
+        if reflections is None:
+            reflections = dict((k, family[data.ambient_positive_roots[k]]) for k in self.simple_root_indices)
+
+        # enumerate the elements along the orbit of rho
+        generators = [(tuple((q, c) for (q, c) in enumerate(data.positive_coroots[k]) if c), data.positive_roots[k],
+                       reflections[k]) for k in self.simple_root_indices]
+        rho = (1,) * data.rank
+        self.elements = [weyl_group.one()]
+        self.lengths = [0]
+        self.rho_images = [rho]
+        level = [0]
+        while level:
+            seen = set()
+            next_level = []
+            for i in level:
+                vec = self.rho_images[i]
+                for (coroot, root, s) in generators:
+                    n = sum(c * vec[q] for (q, c) in coroot)
+                    if n > 0:
+                        new_vec = tuple(x - n * a for (x, a) in zip(vec, root))
+                        if new_vec not in seen:
+                            seen.add(new_vec)
+                            next_level.append(len(self.elements))
+                            self.elements.append(s * self.elements[i])
+                            self.lengths.append(self.lengths[i] + 1)
+                            self.rho_images.append(new_vec)
+            level = next_level
+        self._elements = None
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __iter__(self):
+        return iter(self.elements)
 
-def reflection_subgroup(self, generators):
+    def __contains__(self, w):
+        if self._elements is None:
+            self._elements = set(self.elements)
+        return w in self._elements
+
+    def simple_reflections(self):
+        """
+        Return the canonical Coxeter generators of ``self``.
+        """
+        reflections = self.weyl_group.reflections()
+        return [reflections[r] for r in self.simple_roots]
+
+
+def reflection_subgroup(self, generators, reflections=None):
     """
-    Returns subgroup generated by `generators` as a Weyl group.
+    Returns the subgroup generated by the reflections in `generators` as a ``ReflectionSubgroup``.
+
+    The generators are given either as reflections in ``self`` or as roots in
+    the domain of ``self`` (or as positions of positive roots together with
+    ``reflections``, see ``ReflectionSubgroup``). Unlike ``self.subgroup`` the
+    elements stay elements of ``self`` and no recursion or GAP is involved.
     """
-    pass
+    return ReflectionSubgroup(self, generators, reflections)
 
 wg.WeylGroup_gens.minimal_representatives = minimal_representatives
+wg.WeylGroup_gens.parabolic_orbit = parabolic_orbit
+wg.WeylGroup_gens.iter_minimal_representatives = iter_minimal_representatives
 #wg.WeylGroup_gens.bruhat_poset = bruhat_poset
 wg.WeylGroup_gens.parabolic_poset = parabolic_poset
+wg.WeylGroup_gens.parabolic_graph = parabolic_graph
 wg.WeylGroup_gens.parabolic_bruhat_graph = parabolic_bruhat_graph
 wg.WeylGroup_gens.parabolic_weight_graph = parabolic_weight_graph
 wg.WeylGroup_gens.parabolic_weight_graph_enum = parabolic_weight_graph_enum
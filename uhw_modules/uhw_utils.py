@@ -8,15 +8,29 @@ AUTHORS:
 
 - Vít Tuček: initial implementation
 """
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+from sage.arith.all import gcd, lcm
 from sage.categories.sets_cat import cartesian_product
 from sage.combinat.posets.posets import Poset
 from sage.combinat.root_system.weyl_group import WeylGroup
-from sage.misc.cachefunc import cached_method
+from sage.misc.cachefunc import cached_method, cached_function
 #from sage.all import cached_method
 #from Cython.Utils import cached_method
 from sage.geometry.fan import Fan
+from sage.geometry.polyhedron.constructor import Polyhedron
 from sage.graphs.digraph import DiGraph
+from sage.matrix.constructor import matrix
 from sage.misc.latex import latex
+from sage.modules.free_module_element import vector
+from sage.rings.rational_field import QQ
+
+logger = logging.getLogger(__name__)
 
 
 class RootSystemFacets:
@@ -34,26 +48,370 @@ class RootSystemFacets:
     def _get_fan(self):
         """
         Construct the fan of the root system so we have easy access to all facets.
+
+        The maximal cones are the images of the dominant chamber, see ``iter_facets``.
         """
-        rays = self.ambient_space.positive_roots()
-        cones = [[g.action(v) for v in self.ambient_space.fundamental_weights()] for g in self.weyl_group]
-        rays = list(set(v for cone in cones for v in cone))
-        #print rays
-        if self.ambient_space.dimension() == len(self.ambient_space.simple_roots()):
-            cones = [[rays.index(x) for x in cone] for cone in cones]
-            rays = map(lambda x: x.to_vector(), rays)
-        else: # we need to raise the dimension of the cones and work in a quotient space / intersect with hyperplane
-            cones = [[rays.index(x) for x in cone] + [len(rays)] for cone in cones]
-            rays = map(lambda x: x.to_vector(), rays) + [(1,)*self.ambient_space.dimension()]
+        ray_index = {}
+        cones = []
+        for (J, vec, cone) in self.iter_facets(codim=0, rays=True):
+            cones.append([ray_index.setdefault(ray, len(ray_index)) for ray in cone])
+        rays = sorted(ray_index, key=ray_index.get)
+        rays = [self._to_ambient(ray).to_vector() for ray in rays]
+        if self.ambient_space.dimension() != len(self.ambient_space.simple_roots()):
+            # we need to raise the dimension of the cones and work in a quotient space / intersect with hyperplane
+            cones = [cone + [len(rays)] for cone in cones]
+            rays = rays + [(1,)*self.ambient_space.dimension()]
         return Fan(cones=cones, rays=rays)
-    
-    def facets(self, dim=None, codim=None): 
+
+    def _to_ambient(self, vec):
+        """
+        Returns the element of the ambient space with coordinates ``vec`` in the basis of fundamental weights.
+        """
+        omega = self.ambient_space.fundamental_weights()
+        return self.ambient_space.sum(c * omega[i] for (c, i) in zip(vec, self.ambient_space.index_set()) if c)
+
+    def iter_facets(self, dim=None, codim=None, rays=False):
+        r"""
+        Iterate over the facets of the root system fan without constructing the fan.
+
+        A facet is the cone spanned by `w(\omega_i)`, `i \notin J`, for a subset `J`
+        of simple roots and `w \in W^J`. It is returned as the pair ``(J, vec)`` where
+        ``vec`` is the image `w(\sum_{i \notin J} \omega_i)` in the basis of fundamental
+        weights, which lies in the relative interior of the facet. If ``rays`` is true, the
+        tuple of the rays `w(\omega_i)` (in the same basis) is added as the third entry.
+
+        The facets are produced by dimension (that is ``rank - len(J)``, the dimension in
+        the span of the roots), subset by subset and level by level of the orbits of the
+        characteristic vectors, so only one level of an orbit is kept in memory.
+
+        EXAMPLES::
+
+            sage: F = RootSystemFacets(['A', 2])
+            sage: [len(list(F.iter_facets(dim=d))) for d in range(3)]
+            [1, 6, 6]
+            sage: list(F.iter_facets(dim=1))[:2]
+            [((1,), (0, 1)), ((1,), (1, -1))]
+        """
+        from itertools import combinations
+        from monkey_patches import cartan_data, _orbit_levels
+
+        data = cartan_data(self.weyl_group.cartan_type())
+        if codim is not None:
+            dim = data.rank - codim
+        dimensions = range(data.rank + 1) if dim is None else [dim]
+        for d in dimensions:
+            for J in combinations(data.index_set, data.rank - d):
+                cones = [tuple(tuple(int(p == q) for q in range(data.rank))
+                               for (p, i) in enumerate(data.index_set) if i not in J)]
+                for level in _orbit_levels(data, J, data.index_set):
+                    if rays:
+                        cones = [tuple(data.simple_reflection(ray, p) for ray in cones[parent])
+                                 if parent >= 0 else cones[0] for (vec, parent, p) in level]
+                        for ((vec, parent, p), cone) in zip(level, cones):
+                            yield J, vec, cone
+                    else:
+                        for (vec, parent, p) in level:
+                            yield J, vec
+
+    @cached_method
+    def _simple_coroots(self):
+        return [self.ambient_space.simple_root(i).associated_coroot() for i in self.ambient_space.index_set()]
+
+    def _coordinates(self, weight):
+        """
+        Returns the coordinates of ``weight + rho`` in the basis of fundamental weights.
+        """
+        v = weight + self.rho
+        return tuple(c.scalar(v) for c in self._simple_coroots())
+
+    def facet_key(self, weight):
+        r"""
+        Returns a hashable key of the facet containing ``weight``.
+
+        The facets are taken with respect to the dot action, so two weights `\lambda`
+        and `\mu` have the same key iff `\langle \lambda + \rho, \alpha^\vee \rangle` and
+        `\langle \mu + \rho, \alpha^\vee \rangle` have the same sign for all positive
+        roots `\alpha`. The key is the pair of bitmasks over the positive roots of the
+        roots where the pairing vanishes and where it is negative.
+
+        EXAMPLES::
+
+            sage: F = RootSystemFacets(['A', 2])
+            sage: w1 = F.ambient_space.fundamental_weight(1)
+            sage: F.facet_key(-3 * w1) == F.facet_key(-4 * w1)
+            True
+            sage: F.facet_key(-2 * w1) == F.facet_key(-3 * w1)
+            False
+            sage: F.facet_key(-F.rho)
+            (7, 0)
+        """
+        from monkey_patches import cartan_data
+
+        coordinates = self._coordinates(weight)
+        zero = negative = 0
+        for (k, coroot) in enumerate(cartan_data(self.weyl_group.cartan_type()).positive_coroots):
+            n = sum(c * x for (c, x) in zip(coroot, coordinates) if c)
+            if n == 0:
+                zero |= 1 << k
+            elif n < 0:
+                negative |= 1 << k
+        return zero, negative
+
+    def facet_of(self, weight):
+        """
+        Returns the facet containing ``weight`` (shifted by ``rho``) as the pair ``(J, vec)`` used by ``iter_facets``.
+
+        EXAMPLES::
+
+            sage: F = RootSystemFacets(['A', 2])
+            sage: w1 = F.ambient_space.fundamental_weight(1)
+            sage: F.facet_of(-w1)
+            ((1,), (0, 1))
+            sage: F.facet_of(-2 * w1)
+            ((2,), (-1, 1))
+            sage: F.facet_of(-2 * w1) in F.iter_facets(dim=1)
+            True
+        """
+        from monkey_patches import cartan_data
+
+        data = cartan_data(self.weyl_group.cartan_type())
+        vec = self._coordinates(weight)
+        # move to the dominant chamber, recording the simple reflections
+        word = []
+        p = next((p for (p, x) in enumerate(vec) if x < 0), None)
+        while p is not None:
+            vec = data.simple_reflection(vec, p)
+            word.append(p)
+            p = next((p for (p, x) in enumerate(vec) if x < 0), None)
+        J = tuple(i for (i, x) in zip(data.index_set, vec) if x == 0)
+        # and move the characteristic vector of J back
+        vec = tuple(int(x != 0) for x in vec)
+        for p in reversed(word):
+            vec = data.simple_reflection(vec, p)
+        return J, vec
+
+    def facets(self, dim=None, codim=None):
         """
-        Iterate over cones of root system fan of dimension d and return them as polyhedron shifted to -rho. 
+        Iterate over cones of root system fan of dimension d and return them as polyhedron shifted to -rho.
         """
-        for cone in self._get_fan().cones(dim=dim, codim=codim):
-            yield (cone.polyhedron() - self.rho).to_vector()
-        
+        vertex = (-self.rho).to_vector()
+        for (J, vec, cone) in self.iter_facets(dim, codim, rays=True):
+            yield Polyhedron(vertices=[vertex], rays=[self._to_ambient(ray).to_vector() for ray in cone])
+
+
+class Stats(object):
+    """
+    Collects running times and counters of the stages of a computation.
+
+    Pass an instance as the ``stats`` argument of the methods of
+    ``HermitianSymmetricPair`` to see where the time goes. The times of the
+    stages are also logged at the ``DEBUG`` level.
+
+    EXAMPLES::
+
+        sage: stats = Stats()
+        sage: with stats.timer("stage"):
+        ....:     stats.count("items", 3)
+        sage: stats.calls["stage"], stats.counters["items"]
+        (1, 3)
+    """
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.times[stage] += elapsed
+            self.calls[stage] += 1
+            logger.debug("%s took %.6f s", stage, elapsed)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def __repr__(self):
+        lines = ["%s: %.6f s in %d calls" % (stage, self.times[stage], self.calls[stage])
+                 for stage in sorted(self.times)]
+        lines += ["%s: %d" % (name, self.counters[name]) for name in sorted(self.counters)]
+        return "\n".join(lines)
+
+class PosetEmbedding(object):
+    """
+    A homomorphism from a Weyl group into ``weyl_group`` given by the images of the simple reflections.
+
+    ``embedding`` maps the nodes of the source Weyl group to the keys of
+    ``weyl_group.reflections()``, i.e. to positive roots. The image of an
+    element `w` is computed from the image of `w s_i` for a right descent `i`
+    of `w` by a single multiplication, and all images are cached, so the same
+    instance can relabel many posets of the source group.
+
+    EXAMPLES::
+
+        sage: W = WeylGroup(["A", 3], prefix="s")
+        sage: L = W.domain()
+        sage: embedding = {1: L.simple_root(1), 2: L.simple_root(2) + L.simple_root(3)}
+        sage: f = PosetEmbedding(W, embedding)
+        sage: V = WeylGroup(["A", 2], prefix="s")
+        sage: all(f(w) == W.from_reduced_word([embedding[j] for j in w.reduced_word()], word_type="all") for w in V)
+        True
+        sage: f.relabel(V.bruhat_poset()).cardinality()
+        6
+    """
+    def __init__(self, weyl_group, embedding):
+        self.weyl_group = weyl_group
+        reflections = weyl_group.reflections()
+        self.generators = dict((j, reflections[r]) for (j, r) in embedding.items())
+        self._cache = {}
+
+    def __call__(self, w):
+        # walk down along right descents to an element with a known image
+        path = []
+        while w not in self._cache:
+            i = w.first_descent(side="right")
+            if i is None:
+                self._cache[w] = self.weyl_group.one()
+                break
+            path.append((w, i))
+            w = w.apply_simple_reflection(i, side="right")
+        image = self._cache[w]
+        for (u, i) in reversed(path):
+            image = image * self.generators[i]
+            self._cache[u] = image
+        return image
+
+    def relabel(self, poset):
+        """
+        Returns ``poset`` with its elements replaced by their images.
+        """
+        return poset.relabel(self)
+
+
+class IntegralWeight(object):
+    """
+    A weight stored exactly as integer coordinates in the basis of fundamental weights over a common denominator.
+
+    The pairing with a coroot is the dot product of its coefficients in the basis
+    of simple coroots with ``numerators``, divided by ``denominator``. This avoids
+    the generic rational arithmetic of the ambient space.
+
+    A weight of an ambient space need not lie in the span of its fundamental
+    weights (e.g. in type A). Its component orthogonal to the roots is kept as
+    the tuple of ambient coordinates ``center`` (``None`` if it is zero), so that
+    ``to_weight`` gives back the original weight. It does not enter the pairings.
+
+    EXAMPLES::
+
+        sage: L = RootSystem(['B', 2]).ambient_space()
+        sage: IntegralWeight.from_weight(L.rho())
+        (1, 1)
+        sage: v = IntegralWeight.from_weight(L.fundamental_weight(1) / 2)
+        sage: v, v + v
+        ((1, 0)/2, (1, 0))
+        sage: v.to_weight(L) == L.fundamental_weight(1) / 2
+        True
+        sage: v.pairing((1, 1))
+        1/2
+        sage: L = RootSystem(['A', 3]).ambient_space()
+        sage: u = IntegralWeight.from_weight(L.simple_root(3))
+        sage: u
+        (0, -1, 2) + (-1, -1, -1, -1)
+        sage: u.to_weight(L) == L.simple_root(3), (u + u).to_weight(L) == 2 * L.simple_root(3)
+        (True, True)
+    """
+    __slots__ = ("numerators", "denominator", "center")
+
+    def __init__(self, numerators, denominator=1, center=None):
+        numerators = tuple(int(x) for x in numerators)
+        denominator = int(denominator)
+        if denominator < 0:
+            numerators, denominator = tuple(-x for x in numerators), -denominator
+        g = abs(int(reduce(gcd, numerators, denominator)))
+        self.numerators = tuple(x // g for x in numerators)
+        self.denominator = denominator // g
+        if center is not None:
+            center = tuple(QQ(x) for x in center)
+            if not any(center):
+                center = None
+        self.center = center
+
+    @classmethod
+    def from_weight(cls, weight):
+        """
+        Returns the ``IntegralWeight`` of an element of a root lattice realization.
+        """
+        L = weight.parent()
+        coordinates = [L.simple_root(i).associated_coroot().scalar(weight) for i in L.index_set()]
+        d = lcm([QQ(x).denominator() for x in coordinates] + [1])
+        rest = weight - L.sum(QQ(x) * L.fundamental_weight(i) for (x, i) in zip(coordinates, L.index_set()) if x)
+        center = tuple(rest.to_vector()) if rest and hasattr(rest, 'to_vector') else None
+        return cls([x * d for x in coordinates], d, center)
+
+    def to_weight(self, space):
+        """
+        Returns ``self`` as an element of ``space``, e.g. an ambient space.
+
+        The ``center`` is added in the coordinates of ``space``, so it has to be
+        the space the weight came from.
+        """
+        omega = space.fundamental_weights()
+        weight = space.sum(QQ(x) / self.denominator * omega[i] for (x, i) in zip(self.numerators, space.index_set()) if x)
+        if self.center is not None:
+            weight += space.from_vector(vector(QQ, self.center))
+        return weight
+
+    def pairing(self, coroot):
+        """
+        Returns the pairing with the coroot given by its coefficients in the basis of simple coroots.
+        """
+        return QQ(sum(c * x for (c, x) in zip(coroot, self.numerators))) / self.denominator
+
+    def __add__(self, other):
+        d = self.denominator * other.denominator
+        if self.center is None or other.center is None:
+            center = self.center if other.center is None else other.center
+        else:
+            center = [x + y for (x, y) in zip(self.center, other.center)]
+        return IntegralWeight([x * other.denominator + y * self.denominator
+                               for (x, y) in zip(self.numerators, other.numerators)], d, center)
+
+    def __neg__(self):
+        center = None if self.center is None else [-x for x in self.center]
+        return IntegralWeight([-x for x in self.numerators], self.denominator, center)
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __mul__(self, c):
+        c = QQ(c)
+        center = None if self.center is None else [c * x for x in self.center]
+        return IntegralWeight([x * c.numerator() for x in self.numerators], self.denominator * c.denominator(), center)
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        return (isinstance(other, IntegralWeight) and self.numerators == other.numerators
+                and self.denominator == other.denominator and self.center == other.center)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.numerators, self.denominator, self.center))
+
+    def __repr__(self):
+        if self.denominator == 1:
+            result = repr(self.numerators)
+        else:
+            result = "%r/%d" % (self.numerators, self.denominator)
+        if self.center is not None:
+            result += " + (%s)" % ", ".join(str(x) for x in self.center)
+        return result
+
 
 class RootWithScalarProduct:
     """
@@ -61,6 +419,8 @@ class RootWithScalarProduct:
     """
     def __init__(self, r, v):
         self.root = r
+        if isinstance(v, IntegralWeight):
+            v = v.to_weight(r.parent()).to_vector()
         self.scalarproduct = v.dot_product(r.associated_coroot().to_vector())
 
     def _latex_(self):
@@ -121,10 +481,121 @@ def get_length_function(positive_roots):
         return len([a for a in positive_roots if WG_action(w.inverse(), -a) in positive_roots])
     return l
 
+@cached_function
+def root_lattice_to_ambient(space):
+    r"""
+    Returns the matrix mapping the coordinates of an element of the root lattice in the basis of
+    fundamental weights (as a row vector) to its coordinates in the ambient ``space``.
+
+    Going through the simple roots keeps the components orthogonal to the roots,
+    e.g. the central component in type A, which the fundamental weights of the
+    ambient space do not see. Use it for differences like `w \cdot v - v`.
+
+    EXAMPLES::
+
+        sage: L = RootSystem(['A', 2]).ambient_space()
+        sage: vector(QQ, [-1, 2]) * root_lattice_to_ambient(L) == L.simple_root(2).to_vector()
+        True
+    """
+    I = space.index_set()
+    # the rows are the simple roots in the basis of fundamental weights
+    cartan = matrix(QQ, [[space.simple_root(i).associated_coroot().scalar(space.simple_root(j)) for i in I]
+                         for j in I])
+    return cartan.inverse() * matrix(QQ, [space.simple_root(j).to_vector() for j in I])
+
+def integral_array(vectors, dimension=None):
+    """
+    Returns a pair ``(A, d)`` where the rows of the integer NumPy array ``A`` are the coordinates of ``vectors`` multiplied by their common denominator ``d``.
+
+    The vectors can be elements of a root lattice realization (e.g. roots or
+    weights in the ambient space) or anything convertible to a list of
+    rationals. Scaling by ``d > 0`` does not change signs of scalar products,
+    so the kernels below can work with exact integer arithmetic.
+
+    EXAMPLES::
+
+        sage: L = RootSystem(['E', 7]).ambient_space()
+        sage: A, d = integral_array([L.rho()])
+        sage: d, A.tolist()
+        (2, [[0, 2, 4, 6, 8, 10, -17, 17]])
+    """
+    rows = [list(v.to_vector()) if hasattr(v, 'to_vector') else list(v) for v in vectors]
+    if dimension is None:
+        dimension = len(rows[0])
+    d = lcm([QQ(x).denominator() for row in rows for x in row] + [1])
+    return np.array([[int(x * d) for x in row] for row in rows], dtype=np.int64).reshape(len(rows), dimension), int(d)
+
+def indices_to_mask(indices):
+    """
+    Returns the bitset of ``indices`` as an integer.
+
+    EXAMPLES::
+
+        sage: indices_to_mask([0, 3])
+        9
+    """
+    mask = 0
+    for k in indices:
+        mask |= 1 << k
+    return mask
+
+def weyl_group_matrices(elements):
+    """
+    Returns a pair ``(M, d)`` where ``M`` is the stack of the matrices of ``elements`` multiplied by their common denominator ``d``.
+    """
+    matrices = [w.matrix() for w in elements]
+    dimension = matrices[0].nrows() if matrices else 0
+    A, d = integral_array([m.list() for m in matrices], dimension ** 2)
+    return A.reshape(len(matrices), dimension, dimension), d
+
+def batch_action(matrices, vectors):
+    """
+    Applies each of the stacked ``matrices`` to each row of ``vectors``.
+
+    Returns an array of shape ``(len(matrices), len(vectors), dimension)``.
+    """
+    return np.einsum('kij,mj->kmi', matrices, vectors)
+
+def batch_inversion_sets(rho_images, positive_roots):
+    r"""
+    Returns the boolean array whose entry ``(k, j)`` says whether `w_k^{-1}(\alpha_j)` is negative.
+
+    Here ``rho_images`` are the images `w_k(\rho)` of a regular dominant
+    weight and ``positive_roots`` the positive roots, both as rows of arrays
+    in the same (orthonormal) basis. We use that `w^{-1}(\alpha) < 0` iff
+    `(w(\rho), \alpha) < 0`. For `w` in a reflection subgroup and the
+    positive roots of its root subsystem this gives the inversion set in the
+    subgroup.
+    """
+    return np.dot(rho_images, np.transpose(positive_roots)) < 0
+
+def batch_lengths(rho_images, positive_roots):
+    """
+    Returns the lengths of the elements `w_k` given by ``rho_images``, see ``batch_inversion_sets``.
+
+    EXAMPLES::
+
+        sage: W = WeylGroup(['A', 3])
+        sage: L = W.domain()
+        sage: M, d = weyl_group_matrices(W)
+        sage: rho, _ = integral_array([L.rho()])
+        sage: R, _ = integral_array(L.positive_roots())
+        sage: list(batch_lengths(batch_action(M, rho)[:, 0, :], R)) == [w.length() for w in W]
+        True
+    """
+    return batch_inversion_sets(rho_images, positive_roots).sum(axis=1)
+
+def batch_is_dominant(vectors, positive_roots):
+    """
+    Returns the boolean array saying which rows of ``vectors`` have positive scalar product with all ``positive_roots``.
+    """
+    return (np.dot(vectors, np.transpose(positive_roots)) > 0).all(axis=1)
+
 def generate_subgroup(generators):
     """
     Keep multiplying and taking inverses as long as new elements are constructed.
     Unfortunately, this routine takes too much time in practice.
+    For subgroups generated by reflections use ``WeylGroup.reflection_subgroup`` instead.
     """
     new = set(a*b for (a,b) in cartesian_product([generators, generators])).union(set(g.inverse() for g in generators))
     if new == generators:
@@ -132,9 +603,41 @@ def generate_subgroup(generators):
     else:
         return generate_subgroup(new)
 
+def canonical_simple_roots(positive_roots):
+    r"""
+    Returns the canonical simple roots of the reflection subgroup with the given positive roots.
+
+    A reflection subgroup `W'` of a Weyl group has the root subsystem
+    `\Phi' = \{\beta : s_\beta \in W'\}` and ``positive_roots`` should be
+    `\Phi' \cap \Phi^+`. The reflections in the canonical simple roots are the
+    Coxeter generators of `W'` found by ``DyerCoxeterGenerators`` (see [Dyer]).
+    They are exactly the roots indecomposable in the positive cone of `\Phi'`,
+    i.e. those which are not a sum of two roots from ``positive_roots``, so
+    no group elements or lengths are involved. The roots can be elements of
+    any root lattice realization or integer tuples.
+
+    EXAMPLES::
+
+        sage: e = RootSystem(['B', 3]).ambient_space().basis()
+        sage: canonical_simple_roots([e[0] - e[1], e[0] + e[1], e[2]])
+        [(1, -1, 0), (1, 1, 0), (0, 0, 1)]
+        sage: canonical_simple_roots([(1, 0), (0, 1), (1, 1)])
+        [(1, 0), (0, 1)]
+    """
+    positive_roots = list(positive_roots)
+    roots = set(positive_roots)
+    if positive_roots and isinstance(positive_roots[0], tuple):
+        def difference(a, b):
+            return tuple(x - y for (x, y) in zip(a, b))
+    else:
+        def difference(a, b):
+            return a - b
+    return [b for b in positive_roots if not any(difference(b, a) in roots for a in positive_roots)]
+
 def DyerN(w):
     W = w.parent()
     return [t for t in W.reflections() if (t*w).length() < w.length()]
 
 def DyerCoxeterGenerators(H):
+    # see canonical_simple_roots for a version which avoids lengths
     return [w for w in H if set(DyerN(w)) == set([w])]
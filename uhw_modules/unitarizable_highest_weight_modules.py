@@ -18,6 +18,10 @@ REFERENCES:
    *Differential Operators and Highest Weight Representations*
     Memoirs of the American Mathematical Society, 1991.
     
+.. [EHW] Enright, Howe, Wallach
+   *A classification of unitary highest weight modules*
+   Representation theory of reductive groups, Progress in Mathematics 40, 1983.
+
 .. [E] Enright
    *Analogues of Kostant's u-cohomology formulas for unitary highest modules*
    Journal für die reine und angewandte Mathematik 392, 1988.
@@ -26,12 +30,50 @@ AUTHORS:
 
 - Vít Tuček: initial implementation
 """
+import itertools
+import logging
+import multiprocessing
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
 from sage.misc.cachefunc import cached_method
 from sage.modules.free_module_element import vector
-from sage.misc.abstract_method import abstract_method
+from sage.matrix.constructor import matrix
+from sage.rings.polynomial.polynomial_ring_constructor import PolynomialRing
+from sage.combinat.root_system.cartan_type import CartanType
 from sage.combinat.root_system.root_system import RootSystem
 from sage.combinat.root_system.weyl_group import WeylGroup
-from uhw_utils import RootSystemFacets, get_length_function, WG_action, generate_subgroup
+from sage.combinat.posets.posets import Poset
+from sage.rings.rational_field import QQ
+from sage.rings.integer_ring import ZZ
+from sage.arith.all import lcm
+from uhw_utils import (IntegralWeight, PosetEmbedding, RootSystemFacets, Stats, integral_array, indices_to_mask,
+                       root_lattice_to_ambient, batch_action, batch_is_dominant, weyl_group_matrices)
+
+logger = logging.getLogger(__name__)
+
+
+def hermitian_symmetric_index_sets(cartan_type):
+    """
+    Returns the index sets of the Levi parts of all Hermitian symmetric pairs with the given simple Cartan type.
+    The Levi part is obtained by removing one of the nodes of the Dynkin diagram with coefficient 1 in the highest root.
+
+    EXAMPLES::
+
+        sage: hermitian_symmetric_index_sets(["D", 4])
+        [[2, 3, 4], [1, 2, 4], [1, 2, 3]]
+        sage: hermitian_symmetric_index_sets(["E", 8])
+        []
+    """
+    cartan_type = CartanType(cartan_type)
+    letter, n = cartan_type.type(), cartan_type.rank()
+    noncompact_nodes = {"A": range(1, n + 1),
+                        "B": [1],
+                        "C": [n],
+                        "D": [1, n - 1, n],
+                        "E": {6: [1, 6], 7: [7]}.get(n, [])}.get(letter, [])
+    return [[i for i in cartan_type.index_set() if i != k] for k in noncompact_nodes]
 
 
 class ParabolicPair:
@@ -52,160 +94,909 @@ class ParabolicPair:
         self.nonparabolic_roots = [x.to_ambient() for x in
                                    self.root_lattice.positive_roots_nonparabolic(index_set=index_set)]
         self.nonparabolic_root_poset = self.root_poset.subposet(self.nonparabolic_roots)
+        self._build_root_tables()
+        self._subsystem_data_cache = OrderedDict()
+        self.subsystem_cache_size = 16
+        self._embeddings = {}
+
+    def _build_root_tables(self):
+        """
+        Builds the tables of positive roots used by the per-weight computations.
+
+        The ``k``-th positive root is ``self.positive_roots[k]`` and the rows of the
+        integer arrays are indexed the same way:
+
+        - ``roots``, ``coroots`` -- ambient coordinates multiplied by ``root_denominator``
+          and ``coroot_denominator`` respectively
+        - ``coroot_coefficients`` -- coroots in the basis of simple coroots, their dot products
+          with the ``numerators`` of an ``IntegralWeight`` are the (scaled) pairings
+        - ``root_gram`` -- the scalar products of the rows of ``roots``
+        - ``short_roots`` -- true for the short roots of a non simply laced root system
+        - ``parabolic_mask`` -- true for the roots of the Levi part
+        - ``heights`` -- the heights of the roots
+        - ``reflection_index`` -- position of the reflection of the root in ``weyl_group.reflections()``
+        - ``reflections`` -- the reflections of the roots, ``reflection_id`` is the inverse dictionary
+          (``root_index`` is the one of ``positive_roots``)
+        - ``parabolic_bits`` -- ``parabolic_mask`` as a bitset, see ``indices_to_mask``
+        - ``fundamental_weights`` -- ambient coordinates multiplied by ``weight_denominator``
+        """
+        self.positive_roots = [r.to_ambient() for r in self.root_lattice.positive_roots()]
+        self.root_index = dict((r, k) for (k, r) in enumerate(self.positive_roots))
+        dimension = self.ambient_space.dimension()
+        self.roots, self.root_denominator = integral_array(self.positive_roots, dimension)
+        self.coroots, self.coroot_denominator = integral_array([r.associated_coroot() for r in self.positive_roots],
+                                                               dimension)
+        self.coroot_coefficients = np.array([[int(r.associated_coroot().coefficient(i)) for i in self.root_lattice.index_set()]
+                                             for r in self.root_lattice.positive_roots()], dtype=np.int64)
+        self.root_gram = np.dot(self.roots, self.roots.T)
+        norms = np.diagonal(self.root_gram)
+        self.short_roots = norms < norms.max()
+        self.parabolic_mask = np.array([all(i in self.index_set for i in r.support())
+                                        for r in self.root_lattice.positive_roots()], dtype=bool)
+        reflections = self.weyl_group.reflections()
+        reflection_position = dict((r, k) for (k, r) in enumerate(reflections.keys()))
+        self.reflection_index = np.array([reflection_position[r] for r in self.positive_roots], dtype=np.int64)
+        self.reflections = [reflections[r] for r in self.positive_roots]
+        self.reflection_id = dict((s, k) for (k, s) in enumerate(self.reflections))
+        self.parabolic_bits = indices_to_mask(np.flatnonzero(self.parabolic_mask).tolist())
+        self.parabolic_roots = [r for (r, p) in zip(self.positive_roots, self.parabolic_mask) if p]
+        self.heights = np.array([r.height() for r in self.root_lattice.positive_roots()], dtype=np.int64)
+        self.fundamental_weights, self.weight_denominator = integral_array(
+            [self.ambient_space.fundamental_weight(i) for i in self.ambient_space.index_set()], dimension)
+
+    def root_id(self, x):
+        """
+        Returns the position in ``self.positive_roots`` of the reflection or (positive or negative) root ``x``.
+        """
+        if x.parent() is self.weyl_group:
+            return self.reflection_id[x]
+        return self.root_index[x] if x in self.root_index else self.root_index[-x]
+
+    def reflection_subgroup(self, generators):
+        """
+        Returns the ``ReflectionSubgroup`` of ``self.weyl_group`` generated by the reflections in ``generators``,
+        which are given as reflections or as roots of ``self.ambient_space``.
+
+        The generators are converted with the tables of ``_build_root_tables``, the positions
+        of the roots agree with those of ``cartan_data``.
+
+        EXAMPLES::
+
+            sage: P = ParabolicPair(["B", 2], [1])
+            sage: e = P.ambient_space.basis()
+            sage: H = P.reflection_subgroup([e[0] + e[1], e[0] - e[1]])
+            sage: H.positive_roots, H.lengths
+            ([(1, -1), (1, 1)], [0, 1, 1, 2])
+            sage: P.reflection_subgroup(H.simple_reflections()).positive_roots == H.positive_roots
+            True
+        """
+        return self.weyl_group.reflection_subgroup([self.root_id(x) for x in generators], self.reflections)
+
+    def integral_weight(self, v):
+        """
+        Returns ``v`` as an ``IntegralWeight``, i.e. exactly in the basis of fundamental weights.
+        The methods of the pair accept such weights in place of elements of ``self.ambient_space``.
+        """
+        return IntegralWeight.from_weight(v)
+
+    def _pairings(self, v):
+        """
+        Returns ``(n, d)`` such that ``n[k] / d`` is the pairing of ``v + rho`` with the ``k``-th positive coroot.
+        """
+        if isinstance(v, IntegralWeight):
+            shifted = np.array(v.numerators, dtype=np.int64) + v.denominator
+            return np.dot(self.coroot_coefficients, shifted), v.denominator
+        shifted, e = integral_array([v + self.rho], self.ambient_space.dimension())
+        return np.dot(self.coroots, shifted[0]), e * self.coroot_denominator
 
     @cached_method
     def get_root_system_facets(self):
         return RootSystemFacets(self.cartan_type)
 
     def symbolic_weight_poset(self, cone, weyl_group_poset):
-        """
+        r"""
         Returns a poset of weights with symbolic coordinates given by action of weyl_group_poset on the vertex of the cone. 
         The symbolic coordinates parametrize the interior of the cone even if the weyl_group_poset is valid only on a subpolyhedron. 
         This way it is easier to compare cohomology for different subpolyhedra.
+
+        The ``cone`` is a polyhedron with a single vertex `\mu` in the coordinates of ``self.ambient_space``,
+        e.g. one of ``get_root_system_facets().facets()``. Its points are `\lambda = \mu + \sum_i t_i r_i` for the rays
+        `r_i` in the order of ``cone.rays()``, so that `w \cdot \lambda = w(\mu + \rho) - \rho + \sum_i t_i w(r_i)`
+        is affine in the parameters `t`. The affine maps of all elements of ``weyl_group_poset`` are computed here
+        once and returned as a ``SymbolicWeightPoset``, which evaluates them for many parameters at once.
+
+        EXAMPLES::
+
+            sage: P = ParabolicPair(["A", 2], [])
+            sage: L = P.ambient_space
+            sage: cone = Polyhedron(vertices=[(-L.rho()).to_vector()],
+            ....:                   rays=[L.fundamental_weight(1).to_vector(), L.fundamental_weight(2).to_vector()])
+            sage: T = P.symbolic_weight_poset(cone, P.weyl_group.bruhat_poset())
+            sage: T
+            Symbolic weight poset of 6 elements with 2 parameters
+            sage: T.evaluate([(1, 1)])[0] == [w.action(L.rho()) - L.rho() for w in T.elements]
+            True
+            sage: T((1, 1)).cardinality()
+            6
+            sage: P.symbolic_weight_poset(cone, P.weyl_group.parabolic_poset([1]))((1, 1)).cardinality()
+            3
         """
-        pass
+        if len(cone.vertices()) != 1:
+            raise ValueError("the cone has to have a single vertex")
+        vertex = vector(QQ, cone.vertices()[0].vector())
+        rays = matrix(QQ, cone.n_rays(), self.ambient_space.dimension(), [r.vector() for r in cone.rays()]).transpose()
+        rho = self.rho.to_vector()
+        # the Weyl group elements themselves, also for posets which are not facades
+        elements = [weyl_group_poset.unwrap(x) for x in weyl_group_poset]
+        linear, offset = [], []
+        for w in elements:
+            m = w.matrix()
+            linear.extend((m * rays).list())
+            offset.extend(m * (vertex + rho) - rho)
+        linear = matrix(QQ, len(offset), rays.ncols(), linear)
+        return SymbolicWeightPoset(self.ambient_space, weyl_group_poset, elements, linear, vector(QQ, offset))
 
     def kostant_cohomology(self, v):
-        """
+        r"""
         Calculates cohomology of nilpotent radical of the Lie algebra of P with values in a g-dominant and g-integral weight v using Kostant's formula
         Returns minimal length representatives of Weyl group elements organized into a poset.
+
+        The output is the pair ``(poset, weights)`` where ``poset`` is the Bruhat poset
+        of the minimal length representatives `W^P` with ``side='left'`` and
+        ``weights[q]`` is the list of the highest weights `w \cdot v = w(v + \rho) - \rho`
+        for `w \in W^P` of length ``q``. The weights are in the order of the elements
+        of ``kostant_orbit().elements('left')``. The coset data is computed once for the
+        pair, so only the affine action runs for each weight.
+
+        EXAMPLES::
+
+            sage: P = ParabolicPair(["A", 3], [1, 3])
+            sage: poset, H = P.kostant_cohomology(P.ambient_space.zero())
+            sage: poset.cardinality(), [len(Hq) for Hq in H]
+            (6, [1, 1, 2, 1, 1])
+            sage: H[1]
+            [(0, -1, 1, 0)]
+            sage: sorted(str(x) for x in H[2])
+            ['(-1, -1, 2, 0)', '(0, -2, 1, 1)']
+            sage: HP = HermitianSymmetricPair(["A", 3], [1, 3]).enright_cohomology(P.ambient_space.zero())
+            sage: [sorted(map(str, Hq)) for Hq in H] == [sorted(map(str, Hq)) for Hq in HP]
+            True
+        """
+        if isinstance(v, IntegralWeight):
+            weight = v.to_weight(self.ambient_space)
+        else:
+            weight, v = v, IntegralWeight.from_weight(v)
+        if v.denominator != 1 or any(x < 0 for x in v.numerators):
+            raise ValueError("%s is not a dominant integral weight" % (v,))
+        orbit = self.kostant_orbit()
+        # w(v + rho) - rho - v in the basis of fundamental weights; it lies in the root lattice,
+        # so it is mapped to the ambient space through the simple roots
+        numerators = np.array(v.numerators, dtype=np.int64)
+        differences = np.dot(orbit.matrices('left'), numerators + 1) - 1 - numerators
+        ambient = matrix(QQ, differences.tolist()) * root_lattice_to_ambient(self.ambient_space)
+
+        weights = [[] for _ in range(orbit.lengths[-1] + 1)]
+        for (q, row) in zip(orbit.lengths, ambient.rows()):
+            weights[q].append(weight + self.ambient_space.from_vector(row))
+        return self.kostant_poset(), weights
+
+    def kostant_orbit(self):
+        """
+        Returns the ``ParabolicOrbit`` of ``self`` whose nodes are the minimal length representatives `W^P`.
         """
-        pass
+        return self.weyl_group.parabolic_orbit(self.index_set)
+
+    @cached_method
+    def kostant_poset(self):
+        """
+        Returns the Bruhat poset of the minimal length representatives `W^P` with ``side='left'``.
+        """
+        return self.weyl_group.parabolic_poset(self.index_set, side="left")
 
     def get_poset_from_embedding(self, poset, embedding):
         """
         Creates a poset of Weyl group elements of self through mapping via embedding from another poset. Used for relative BGG and Enright-Shelton equivalence.
         :embedding:  is a mapping of simple roots in some other Weyl group into reflections of self.weyl_group implemented via a dictionary indexed by numbers
+
+        The images are computed by the ``PosetEmbedding`` of ``poset_embedding``, which is
+        shared by all calls with the same ``embedding``.
         """
+        return self.poset_embedding(embedding).relabel(poset)
 
-        # # TODO why is this here exactly?
-        # for i in embedding.keys():
-        #     embedding[i] = self.ambient_space.from_vector(vector(embedding[i]))
+    def poset_embedding(self, embedding):
+        """
+        Returns the cached ``PosetEmbedding`` of ``self.weyl_group`` for the dictionary ``embedding``.
+        """
+        key = tuple(sorted(embedding.items()))
+        if key not in self._embeddings:
+            self._embeddings[key] = PosetEmbedding(self.weyl_group, embedding)
+        return self._embeddings[key]
 
-        #       reflections = w.parent().reflections()
-        #       embedding = {}
-        #       for i  in embedding:
-        #           embedding[i] = reflections()[embedding[i]]
-        def embedd(w):
-            reflections_word = map(lambda j: embedding[j], w.reduced_word())
-            return self.weyl_group.from_reduced_word(reflections_word, word_type="all")
+    def relative_bgg(self, other_index_set=None, side="left"):
+        r"""
+        Returns the Bruhat poset of the minimal length representatives `W^P_Q` of `W_P \backslash W_Q`
+        which index the relative BGG sequences for the parabolic `Q \supset P` with Levi part ``other_index_set``.
 
-        # print "Embedding: ", embedding
-        return poset.relabel(embedd)
+        By default ``other_index_set`` contains all nodes, i.e. the result is `W^P`.
+        See ``relative_bgg_chain``.
 
-    def relative_bgg(self, other_index_set=None):
+        EXAMPLES::
+
+            sage: P = ParabolicPair(["A", 3], [1])
+            sage: P.relative_bgg([1, 2]).cardinality()
+            3
         """
-        TODO
-        Have to figure appropriate API first.
+        if other_index_set is None:
+            other_index_set = self.ambient_space.index_set()
+        return self.relative_bgg_chain([self.index_set, other_index_set], side)[0, 1]
+
+    def relative_bgg_chain(self, chain, side="left"):
+        r"""
+        Returns the posets `W^{P_a}_{P_b}` for all pairs ``a < b`` of a chain `P_0 \subset P_1 \subset \dots`
+        of parabolics given by the index sets of their Levi parts.
+
+        The result is a dictionary indexed by the pairs ``(a, b)``. All the posets are
+        obtained by filtering the nodes of the single (cached) orbit of `P_0`, see
+        ``ParabolicOrbit.relative_nodes``.
+
+        EXAMPLES::
+
+            sage: P = ParabolicPair(["A", 3], [1, 2, 3])
+            sage: posets = P.relative_bgg_chain([[], [1], [1, 2], [1, 2, 3]])
+            sage: sorted((k, p.cardinality()) for (k, p) in posets.items())
+            [((0, 1), 2), ((0, 2), 6), ((0, 3), 24), ((1, 2), 3), ((1, 3), 12), ((2, 3), 4)]
         """
-        pass
+        orbit = self.weyl_group.parabolic_orbit(chain[0])
+        elements = orbit.elements(side)
+        covers = orbit.cover_relations()
+        posets = {}
+        for (a, b) in itertools.combinations(range(len(chain)), 2):
+            nodes = set(orbit.relative_nodes(chain[a], chain[b]))
+            posets[a, b] = Poset(([elements[k] for k in sorted(nodes)],
+                                  [(elements[i], elements[j]) for (i, j) in covers if i in nodes and j in nodes]),
+                                 cover_relations=True)
+        return posets
 
 
 class HermitianSymmetricPair(ParabolicPair):
 
-    def get_generating_roots(self, v):
+    def generating_root_indices(self, v, stats=None):
+        """
+        Returns the indices of the generating roots and of the roots ``Psi`` of ``get_generating_roots``.
+        The indices refer to ``self.positive_roots`` and the tables built by ``_build_root_tables``.
+
+        The weight ``v`` can also be an ``IntegralWeight``, then only integer arithmetic is used.
+
+        EXAMPLES::
+
+            sage: P = HermitianSymmetricPair(["C", 3], [1, 2])
+            sage: v = -3/2 * P.ambient_space.fundamental_weight(3)
+            sage: P.generating_root_indices(v) == P.generating_root_indices(P.integral_weight(v))
+            True
+        """
+        stats = Stats() if stats is None else stats
+        with stats.timer("root filtering"):
+            Phi, Psi = self._generating_root_masks(*self._pairings(v))
+        stats.count("weights")
+        return np.flatnonzero(Phi).tolist(), np.flatnonzero(Psi).tolist()
+
+    def _generating_root_masks(self, pairings, d):
+        """
+        Returns the boolean masks of the generating roots and of ``Psi`` for the pairings ``n / d`` of ``_pairings``.
+
+        The last axis of ``pairings`` runs over the positive roots, so the masks of
+        several weights are computed at once if ``d`` is broadcast along the other axes.
+        """
+        singular = pairings == 0
+        # n = <v + rho, r^vee> has to be a positive integer
+        test = (pairings > 0) & (pairings % d == 0)
+        if self.short_roots.any():
+            is_there_long_root = (singular & ~self.short_roots).any(axis=-1)
+            test &= self.short_roots | ~is_there_long_root[..., np.newaxis]
+        test &= ~self.parabolic_mask
+        test &= ~np.dot(singular, self.root_gram != 0)
+        return test, singular
+
+    def get_generating_roots(self, v, stats=None):
         """
         Returns a list of roots that generate the reflection subgroup which governs cohomology of unitarizable hihgest weight modules.
         First part of Enright's formula from his paper on u-cohomology.
         The convention is that Verma modules are induced from lambda (i.e. no rho-shift)
         """
-        Psi = [r for r in self.ambient_space.positive_roots() if r.scalar(self.rho + v) == 0]
+        Phi, Psi = self.generating_root_indices(v, stats)
+        return ([self.positive_roots[k] for k in Phi], [self.positive_roots[k] for k in Psi],
+                self.parabolic_roots, self.nonparabolic_roots)
 
-        if self.ambient_space.cartan_type()[0] in "BCG":
-            print [x.is_short_root() for x in Psi]
-            is_there_long_root = any(not (x.is_short_root()) for x in Psi)
-        else:
-            is_there_long_root = False
-        print "Is there long root:", is_there_long_root
-
-        def test_root(r):
-            n = r.associated_coroot().scalar(v + self.rho)  # TODO check coroot calculations
-            if is_there_long_root:
-                short = r.is_short_root()
-            else:
-                short = True
-            # print r, long_root, short
-            return n.is_integer() and n > 0 and short
-
-        nonparabolic_roots = [x.to_ambient() for x in
-                              self.ambient_space.root_system.root_lattice().positive_roots_nonparabolic(index_set=self.index_set)]
-        parabolic_roots = [x.to_ambient() for x in
-                           self.ambient_space.root_system.root_lattice().positive_roots_parabolic(index_set=self.index_set)]
-        # print("Nonparabolic roots: %s" % sorted(nonparabolic_roots))
-        Phi = [r for r in nonparabolic_roots if test_root(r) and all(r.scalar(s) == 0 for s in Psi)]
-        return Phi, Psi, parabolic_roots, nonparabolic_roots
-
-    def get_subsystem_data(self, v, debug=True):
+    def get_subsystem_data(self, v, debug=False, stats=None):
+        """
+        Returns the data of the reflection subgroup of the weight ``v``, see ``get_generating_roots``.
+
+        If ``debug`` is true, the sizes of the subgroup are logged at the ``INFO`` level instead of ``DEBUG``.
+        The running times of the stages are collected in ``stats`` (see ``Stats``) if it is given.
+        """
         # This should work with self.AS and self.W no?
         #AS = v.parent()
         #W = AS.weyl_group()
-        generating_roots, Psi, parabolic_roots, nonparabolic_roots = self.get_generating_roots(v)
-        reflections = self.weyl_group.reflections()
-        generators = set(reflections[r] for r in generating_roots)
+        generating_roots, Psi, parabolic_roots, nonparabolic_roots = self.get_generating_roots(v, stats)
+        return self.get_subsystem_data_from_roots(generating_roots, Psi, parabolic_roots, nonparabolic_roots,
+                                                  debug, stats)
 
-        if debug:
-            print("Generating subgroup from %d generators" % len(generators))
+    def subsystem_signature(self, Psi, generating_roots):
+        """
+        Returns the pair of bitmasks of ``Psi`` and ``generating_roots`` over ``self.positive_roots``.
+        Weights with the same signature have the same subsystem data.
+        """
+        return (indices_to_mask(self.root_index[r] for r in Psi),
+                indices_to_mask(self.root_index[r] for r in generating_roots))
 
-        # W_lambda = [W.element_class(W, h) for h in W.subgroup(generators)] # too slow
-        if self.ambient_space.rank() < 6:  # BUG gap is exceptionally slow for larger rank
-            W_lambda = self.weyl_group.subgroup(generators)
+    def get_subsystem_data_from_roots(self, generating_roots, Psi, parabolic_roots, nonparabolic_roots,
+                                      debug=False, stats=None):
+        """
+        Does the work of ``get_subsystem_data`` for the output of ``get_generating_roots``.
+        The result depends on the weight only through ``Psi`` and ``generating_roots``,
+        so it is cached by ``subsystem_signature`` and shared between such weights.
+
+        The data keeps all elements of the reflection subgroup, so only the
+        ``subsystem_cache_size`` most recently used signatures are cached.
+        """
+        stats = Stats() if stats is None else stats
+        key = self.subsystem_signature(Psi, generating_roots)
+        data = self._subsystem_data_cache.pop(key, None)
+        if data is not None:
+            stats.count("subsystem cache hits")
         else:
-            W_lambda = list(generate_subgroup(
-                generators))  # subgroup generates H as a matrix group and we lose all the WeylGroupElement methods # too slow
-        if debug:
-            print("The generated subgroup has %d elements" % len(W_lambda))
-        W_lambda_reflections = []
-        for x in W_lambda:
-            g = self.weyl_group.element_class(self.weyl_group, x)
-            if g in reflections:
-                W_lambda_reflections.append(g)
-
-        if debug:
-            print("The subgroup has %d reflections" % len(W_lambda_reflections))
+            stats.count("subsystem cache misses")
+            data = self._compute_subsystem_data(generating_roots, Psi, parabolic_roots, nonparabolic_roots, debug,
+                                                stats)
+        self._subsystem_data_cache[key] = data
+        while len(self._subsystem_data_cache) > self.subsystem_cache_size:
+            self._subsystem_data_cache.popitem(last=False)
+        return data
+
+    def _compute_subsystem_data(self, generating_roots, Psi, parabolic_roots, nonparabolic_roots, debug, stats):
+        log = logger.info if debug else logger.debug
+
+        log("Generating subgroup from %d generators", len(generating_roots))
+
+        # W_lambda = [W.element_class(W, h) for h in W.subgroup(generators)] # too slow
+        # the subgroup is enumerated from its root subsystem, see ReflectionSubgroup
+        with stats.timer("subgroup generation"):
+            W_lambda = self.reflection_subgroup(generating_roots)
+        log("The generated subgroup has %d elements", len(W_lambda))
+        stats.count("subgroup elements", len(W_lambda))
+
+        with stats.timer("reflection extraction"):
+            # the root indices of W_lambda (see cartan_data) agree with those of self.positive_roots;
+            # the subsystem is ordered as the reflections of self.weyl_group
+            lambda_positive = sorted(W_lambda.positive_root_indices, key=self.reflection_index.__getitem__)
+            W_lambda_reflections = [self.reflections[k] for k in lambda_positive]
+        log("The subgroup has %d reflections", len(W_lambda_reflections))
 
         # calculate Coxeter generators of the reflection subgroup
-        # see [Deodhar] or [Dyer] for proof
-        def DyerCoxeterGenerators(H_reflections):
-            # optimized version
-            # H_reflections = [W.element_class(W, x) for x in reflections if x in H] # WARNING switching H and reflections leads to empty set!
-            # H_reflections = [W.element_class(W, x) for x in H if W.element_class(W, x) in reflections] # the previous stopped working in Sage 7.6 # refactored shortly thereafter to assume that we have only reflections at input
-            W_length = get_length_function(self.ambient_space.positive_roots())
+        # see [Deodhar] or [Dyer] for proof; the corresponding simple roots are the
+        # indecomposable roots in the positive cone of the subsystem, so no lengths are needed
+        with stats.timer("Dyer generators"):
+            simple_bits = indices_to_mask(W_lambda.simple_root_indices)
+            lambda_simple = [k for k in lambda_positive if simple_bits >> k & 1]
+            lambda_parabolic = [k for k in lambda_positive if self.parabolic_bits >> k & 1]
+
+            lambda_positive_roots = [self.positive_roots[k] for k in lambda_positive]
+            lambda_simple_roots = [self.positive_roots[k] for k in lambda_simple]
+            lambda_parabolic_roots = [self.positive_roots[k] for k in lambda_parabolic]
+            lambda_nonparabolic_roots = [self.positive_roots[k] for k in lambda_positive if not self.parabolic_bits >> k & 1]
 
-            def DyerN(w):
-                w = self.weyl_group.element_class(self.weyl_group, w)
-                return set(t for t in H_reflections if W_length(t * w) < W_length(w))
+        # decompose coset representative according to their length
+        # the lengths in W_lambda are known from its construction and the
+        # dominance of w(rho) is tested for all w at once
+        with stats.timer("coset decomposition"):
+            rho_images = np.dot(np.array(W_lambda.rho_images, dtype=np.int64), self.fundamental_weights)
+            dominant = batch_is_dominant(rho_images, self.roots[lambda_parabolic])
+
+            lambda_W_c = defaultdict(list)
+            for (w, length, is_dominant) in zip(W_lambda, W_lambda.lengths, dominant):
+                if is_dominant:
+                    lambda_W_c[length].append(w)
+        stats.count("coset representatives", sum(len(l) for l in lambda_W_c.values()))
 
-            return [w for w in H_reflections if DyerN(w) == {w}]
+        return Psi, generating_roots, lambda_simple_roots, lambda_positive_roots, lambda_parabolic_roots, lambda_nonparabolic_roots, W_lambda, lambda_W_c
 
-        coxeter_generators = DyerCoxeterGenerators(W_lambda_reflections)
+    def enright_cohomology(self, v, stats=None):
+        r"""
+        Calculates cohomology of nilpotent radical of the Lie algebra of P with values in a unitarizable highest weight module using Enright's formula.
 
-        lambda_positive_roots = [r for r in reflections.keys() if reflections[r] in W_lambda_reflections]
-        lambda_simple_roots = [r for r in reflections.keys() if reflections[r] in coxeter_generators]
-        lambda_parabolic_roots = [r for r in lambda_positive_roots if r in parabolic_roots]
-        lambda_nonparabolic_roots = [r for r in lambda_positive_roots if r in nonparabolic_roots]
+        Returns a list whose ``q``-th entry is the list of highest weights `w(v + \rho) - \rho`
+        of the Levi modules in degree ``q``, where `w` runs over the elements of length ``q``
+        in ``lambda_W_c`` (see ``get_subsystem_data``).
 
-        # decompose coset representative according to their length
-        from collections import defaultdict
-        def is_dominant(v, positive_roots):
-            return all(v.scalar(r) > 0 for r in positive_roots)
+        EXAMPLES::
 
-        lambda_W_c = defaultdict(list)
-        lambda_length = get_length_function(lambda_positive_roots)
-        for w in W_lambda:
-            if is_dominant(WG_action(w, self.rho), lambda_parabolic_roots):
-                lambda_W_c[lambda_length(w)].append(w)
+            sage: P = HermitianSymmetricPair(["A", 3], [1, 3])
+            sage: [len(H) for H in P.enright_cohomology(P.ambient_space.zero())]
+            [1, 1, 2, 1, 1]
 
-        return Psi, generating_roots, lambda_simple_roots, lambda_positive_roots, lambda_parabolic_roots, lambda_nonparabolic_roots, W_lambda, lambda_W_c
+        The integer path gives the same weights, also for weights with a component
+        orthogonal to the roots::
 
-    def enright_cohomology(self, v):
+            sage: L = P.ambient_space
+            sage: v = L.simple_root(3) - 3 * L.fundamental_weight(2)
+            sage: P.enright_cohomology(P.integral_weight(v)) == P.enright_cohomology(v)
+            True
         """
-        Calculates cohomology of nilpotent radical of the Lie algebra of P with values in a unitarizable highest weight module using Enright's formula.
+        return self.enright_cohomology_batch([v], stats)[0]
+
+    def enright_cohomology_batch(self, weights, stats=None):
+        """
+        Calculates ``enright_cohomology`` for each of the ``weights``.
+
+        Weights with the same ``subsystem_signature`` share the reflection subgroup
+        and its coset representatives, so these are computed only once for each such group.
+        Returns the list of results in the order of ``weights``.
+
+        EXAMPLES::
+
+            sage: P = HermitianSymmetricPair(["A", 3], [1, 3])
+            sage: L = P.ambient_space
+            sage: weights = [L.zero(), -L.fundamental_weight(2), -2 * L.fundamental_weight(2)]
+            sage: stats = Stats()
+            sage: P.enright_cohomology_batch(weights, stats) == [P.enright_cohomology(v) for v in weights]
+            True
+            sage: stats.counters["weights"]
+            3
+        """
+        stats = Stats() if stats is None else stats
+        weights = list(weights)
+        groups = {}
+        for (k, v) in enumerate(weights):
+            Phi, Psi = self.generating_root_indices(v, stats)
+            key = indices_to_mask(Psi), indices_to_mask(Phi)
+            if key not in groups:
+                groups[key] = (Phi, Psi, [])
+            groups[key][-1].append(k)
+
+        result = [None] * len(weights)
+        for (Phi, Psi, positions) in groups.values():
+            lambda_W_c = self.get_subsystem_data_from_roots([self.positive_roots[j] for j in Phi],
+                                                            [self.positive_roots[j] for j in Psi],
+                                                            self.parabolic_roots, self.nonparabolic_roots,
+                                                            stats=stats)[-1]
+            with stats.timer("dot action"):
+                cohomology = self._enright_weights([weights[k] for k in positions], lambda_W_c)
+            for (k, H) in zip(positions, cohomology):
+                result[k] = H
+        return result
+
+    def enright_cohomology_line(self, v, zeta, values, stats=None):
+        r"""
+        Iterates over the pairs ``(z, enright_cohomology(v + z * zeta))`` for `z` in ``values``.
+
+        The pairings with the coroots are affine in `z`, so the generating roots and ``Psi``
+        of all points of the line are computed at once. The reflection subgroup and its coset
+        representatives are only looked up where these change between consecutive values,
+        e.g. at the reduction points of a line of unitarizable weights, and the cohomology of
+        each run of points with the same data is computed by one batched dot action.
+
+        The weights ``v`` and ``zeta`` are elements of ``self.ambient_space`` or ``IntegralWeight``.
+
+        EXAMPLES::
+
+            sage: P = HermitianSymmetricPair(["A", 3], [1, 3])
+            sage: L = P.ambient_space
+            sage: stats = Stats()
+            sage: line = list(P.enright_cohomology_line(L.zero(), -L.fundamental_weight(2), range(6), stats))
+            sage: all(H == P.enright_cohomology(-z * L.fundamental_weight(2)) for (z, H) in line)
+            True
+            sage: stats.counters["line segments"]
+            5
+
+        The weights of the line are the ambient weights ``v + z * zeta``, also when ``v``
+        has a component orthogonal to the roots::
+
+            sage: v = L.simple_root(3)
+            sage: line = P.enright_cohomology_line(v, -L.fundamental_weight(2), range(4))
+            sage: all(H == P.enright_cohomology(v - z * L.fundamental_weight(2)) for (z, H) in line)
+            True
+        """
+        stats = Stats() if stats is None else stats
+        # the integer coordinates are only used for the root filtering
+        if isinstance(v, IntegralWeight):
+            v, v_integral = v.to_weight(self.ambient_space), v
+        else:
+            v_integral = self.integral_weight(v)
+        if isinstance(zeta, IntegralWeight):
+            zeta, zeta_integral = zeta.to_weight(self.ambient_space), zeta
+        else:
+            zeta_integral = self.integral_weight(zeta)
+        values = [QQ(z) for z in values]
+        if not values:
+            return
+
+        with stats.timer("root filtering"):
+            # <v + rho + z zeta, r^vee> = (n b q + m a p) / (a b q) for z = p / q
+            n, a = self._pairings(v_integral)
+            m = np.dot(self.coroot_coefficients, np.array(zeta_integral.numerators, dtype=np.int64))
+            b = zeta_integral.denominator
+            p = np.array([int(z.numerator()) for z in values], dtype=np.int64)[:, np.newaxis]
+            q = np.array([int(z.denominator()) for z in values], dtype=np.int64)[:, np.newaxis]
+            Phi, Psi = self._generating_root_masks(n * b * q + m * a * p, a * b * q)
+            changes = np.flatnonzero((Phi[1:] != Phi[:-1]).any(axis=1) | (Psi[1:] != Psi[:-1]).any(axis=1)) + 1
+        stats.count("weights", len(values))
+
+        bounds = [0] + changes.tolist() + [len(values)]
+        for (start, stop) in zip(bounds, bounds[1:]):
+            stats.count("line segments")
+            lambda_W_c = self.get_subsystem_data_from_roots(
+                [self.positive_roots[j] for j in np.flatnonzero(Phi[start])],
+                [self.positive_roots[j] for j in np.flatnonzero(Psi[start])],
+                self.parabolic_roots, self.nonparabolic_roots, stats=stats)[-1]
+            with stats.timer("dot action"):
+                cohomology = self._enright_weights([v + values[k] * zeta for k in range(start, stop)], lambda_W_c)
+            for (k, H) in zip(range(start, stop), cohomology):
+                yield values[k], H
+
+    def _enright_weights(self, weights, lambda_W_c):
+        r"""
+        Returns the graded lists of weights `w(v + \rho) - \rho` for `w` in ``lambda_W_c`` and each `v` in ``weights``.
+        """
+        degrees = range(max(lambda_W_c) + 1) if lambda_W_c else []
+        elements = [w for q in degrees for w in lambda_W_c[q]]
+        matrices, d = weyl_group_matrices(elements)
+        weights = [v.to_weight(self.ambient_space) if isinstance(v, IntegralWeight) else v for v in weights]
+        shifted, e = integral_array([v + self.rho for v in weights], self.ambient_space.dimension())
+        images = batch_action(matrices, shifted)
+
+        result = []
+        for j in range(len(weights)):
+            column = iter(images[:, j])
+            result.append([[self.ambient_space.from_vector(vector(QQ, next(column).tolist()) / (d * e)) - self.rho
+                            for w in lambda_W_c[q]]
+                           for q in degrees])
+        return result
+
+    def highest_root_index(self):
+        """
+        Returns the index of the highest root in ``self.positive_roots``.
+        """
+        return self.root_index[self.root_lattice.highest_root().to_ambient()]
+
+    def _root_closure(self, generators):
+        """
+        Returns the set of indices of the positive roots of the root subsystem generated by the roots with indices ``generators``.
         """
-        pass
+        index = {}
+        for (k, row) in enumerate(self.roots.tolist()):
+            index[tuple(row)] = k
+            index[tuple(-x for x in row)] = k
+        gram = self.root_gram
+        found = set(generators)
+        todo = list(generators)
+        while todo:
+            a = todo.pop()
+            for b in list(found):
+                for (x, y) in ((a, b), (b, a)):
+                    n = 2 * gram[y, x] // gram[x, x]
+                    k = index[tuple((self.roots[y] - n * self.roots[x]).tolist())]
+                    if k not in found:
+                        found.add(k)
+                        todo.append(k)
+        return found
+
+    @cached_method
+    def unitarizable_cone(self, singular):
+        r"""
+        Returns the ``UnitarizableCone`` of the weights `\lambda` for which ``singular`` is the set
+        of the compact simple roots (given by their nodes) with `\langle \lambda, \alpha^\vee \rangle = 0`.
+
+        The constants are computed as in [EHW]_: let `\Delta(S)` be the root subsystem generated by
+        the highest root `\beta` and those roots of ``singular`` which are connected to `-\beta`
+        in the extended Dynkin diagram. Then `B = \langle \rho(S), \beta^\vee \rangle`, `r` is the
+        length of the cascade of strongly orthogonal noncompact roots of `\Delta(S)` starting
+        with `\beta_1 = \beta` and `C = d/2`, where `d` is the number of noncompact roots
+        `\gamma` of `\Delta(S)` with `\langle \gamma, \beta_1^\vee \rangle = 1 = \langle \gamma, \beta_2^\vee \rangle`.
+
+        EXAMPLES::
+
+            sage: P = HermitianSymmetricPair(["C", 2], [1])
+            sage: P.unitarizable_cone((1,))
+            Unitarizable cone (1,): z < 3/2 or z in [3/2, 2]
+            sage: P.unitarizable_cone(())
+            Unitarizable cone (): z < 1 or z in [1]
+        """
+        singular = tuple(sorted(singular))
+        beta = self.highest_root_index()
+        gram = self.root_gram
+        simple = dict((i, self.root_index[self.ambient_space.simple_root(i)]) for i in self.index_set)
+
+        # the component of -beta in the extended Dynkin diagram
+        component = [beta]
+        todo = [beta]
+        while todo:
+            a = todo.pop()
+            for i in singular:
+                if simple[i] not in component and gram[a, simple[i]] != 0:
+                    component.append(simple[i])
+                    todo.append(simple[i])
+        roots = sorted(self._root_closure(component))
+        B = QQ(sum(gram[k, beta] for k in roots)) / gram[beta, beta]
+
+        # the cascade of strongly orthogonal noncompact roots
+        index = set(tuple(row) for row in self.roots.tolist())
+        index.update(tuple(-x for x in row) for row in self.roots.tolist())
+        def strongly_orthogonal(a, b):
+            return (gram[a, b] == 0 and tuple((self.roots[a] + self.roots[b]).tolist()) not in index
+                    and tuple((self.roots[a] - self.roots[b]).tolist()) not in index)
+        noncompact = [k for k in roots if not self.parabolic_mask[k]]
+        cascade = [beta]
+        candidates = [k for k in noncompact if strongly_orthogonal(k, beta)]
+        while candidates:
+            top = max(candidates, key=lambda k: self.heights[k])
+            cascade.append(top)
+            candidates = [k for k in candidates if strongly_orthogonal(k, top)]
+
+        if len(cascade) > 1:
+            b1, b2 = cascade[:2]
+            d = len([k for k in noncompact if 2 * gram[k, b1] == gram[b1, b1] and 2 * gram[k, b2] == gram[b2, b2]])
+        else:
+            d = 0
+        return UnitarizableCone(singular, B, QQ(d) / 2, len(cascade))
 
-    @abstract_method
     def uhw_cones(self):
         """
         Returns list of cones of highest weights of highest weight unitarizable modules.
+
+        There is one ``UnitarizableCone`` for every subset of the compact simple roots, see ``unitarizable_cone``.
+        """
+        return [self.unitarizable_cone(S) for n in range(len(self.index_set) + 1)
+                for S in itertools.combinations(sorted(self.index_set), n)]
+
+    def is_unitarizable(self, v):
+        """
+        Returns whether the irreducible highest weight module with highest weight ``v`` is unitarizable.
+
+        The weight ``v`` is an element of ``self.ambient_space`` or an ``IntegralWeight``.
+
+        EXAMPLES::
+
+            sage: P = HermitianSymmetricPair(["A", 3], [1, 3])
+            sage: w2 = P.ambient_space.fundamental_weight(2)
+            sage: [t for t in range(-4, 2) if P.is_unitarizable(t * w2)]
+            [-4, -3, -2, -1, 0]
+            sage: P.is_unitarizable(-3/2 * w2)
+            True
+        """
+        pairings, d = self._pairings(v)
+        compact = [(i, QQ(pairings[self.root_index[self.ambient_space.simple_root(i)]]) / d - 1)
+                   for i in self.index_set]
+        if any(not x.is_integer() or x < 0 for (i, x) in compact):
+            return False
+        cone = self.unitarizable_cone(tuple(i for (i, x) in compact if x == 0))
+        return cone.contains(QQ(pairings[self.highest_root_index()]) / d)
+
+    def unitarizable_weights(self, box=None, norm=None, denominator=1):
+        r"""
+        Iterates over the unitarizable highest weights in a box or up to a norm, as ``IntegralWeight``.
+
+        If ``box`` is given, it is a list of iterables of coefficients of the fundamental weights
+        (see ``weight_box``); the one of the noncompact node is traversed repeatedly, so it
+        should be a list or a range. Coefficients of compact nodes which are not nonnegative
+        integers are skipped. If ``norm`` is given, all weights with coefficients in
+        ``1/denominator * ZZ`` and norm at most ``norm`` are considered.
+
+        The weights are generated lazily, coset by coset of the compact coefficients, so only
+        the unitarity constants of the visited cones are kept.
+
+        EXAMPLES::
+
+            sage: P = HermitianSymmetricPair(["C", 2], [1])
+            sage: list(P.unitarizable_weights(box=[[0], [x / 2 for x in range(-3, 2)]]))
+            [(0, -3)/2, (0, -1), (0, -1)/2, (0, 0)]
+            sage: len(list(P.unitarizable_weights(norm=3, denominator=2)))
+            7
+        """
+        nodes = list(self.ambient_space.index_set())
+        k = [p for (p, i) in enumerate(nodes) if i not in self.index_set][0]
+        coroot = self.coroot_coefficients[self.highest_root_index()].tolist()
+        # z = <lambda + rho, beta^vee> = offset + coroot[k] * t
+        if (box is None) == (norm is None):
+            raise ValueError("exactly one of box and norm has to be given")
+        if norm is not None:
+            box, accept = self._norm_box(norm, denominator), self._norm_test(norm)
+        else:
+            accept = None
+        compact_nodes = [i for i in nodes if i in self.index_set]
+
+        for a in itertools.product(*[box[p] for p in range(len(nodes)) if p != k]):
+            a = [QQ(x) for x in a]
+            if any(not x.is_integer() or x < 0 for x in a):
+                continue
+            cone = self.unitarizable_cone(tuple(i for (i, x) in zip(compact_nodes, a) if x == 0))
+            coordinates = a[:k] + [QQ(0)] + a[k:]
+            offset = sum(c * (x + 1) for (c, x) in zip(coroot, coordinates))
+            for t in box[k]:
+                coordinates[k] = QQ(t)
+                if cone.contains(offset + coroot[k] * coordinates[k]):
+                    d = lcm([x.denominator() for x in coordinates])
+                    v = IntegralWeight([x * d for x in coordinates], d)
+                    if accept is None or accept(v):
+                        yield v
+
+    def _norm_box(self, norm, denominator):
+        """
+        Returns the box of coefficients with denominator ``denominator`` containing the ball of radius ``norm``.
+        """
+        # |<v, alpha_i^vee>| <= |v| |alpha_i^vee| = 2 |v| / |alpha_i|
+        box = []
+        for i in self.ambient_space.index_set():
+            alpha = self.root_index[self.ambient_space.simple_root(i)]
+            X = QQ(norm) ** 2 * 4 * denominator ** 2 * self.root_denominator ** 2 / self.root_gram[alpha, alpha]
+            bound = ZZ(X.floor()).isqrt()
+            box.append([QQ(n) / denominator for n in range(-bound, bound + 1)])
+        return box
+
+    def _norm_test(self, norm):
+        bound = QQ(norm) ** 2 * self.weight_denominator ** 2
+        def accept(v):
+            x = np.dot(np.array(v.numerators, dtype=np.int64), self.fundamental_weights)
+            return QQ(int(np.dot(x, x))) / v.denominator ** 2 <= bound
+        return accept
+
+
+class SymbolicWeightPoset(object):
+    r"""
+    The weights `w \cdot \lambda(t)` for the elements `w` of a poset of Weyl group elements, where
+    `\lambda(t)` is an affine function of parameters `t`, see ``ParabolicPair.symbolic_weight_poset``.
+
+    The affine maps of all the elements are stacked into the matrix ``linear`` and the
+    vector ``offset``, so evaluating at many parameters is a single matrix product.
+    """
+    def __init__(self, space, poset, elements, linear, offset):
+        self.space = space
+        self.poset = poset
+        self.elements = elements
+        self.linear = linear
+        self.offset = offset
+
+    def ngens(self):
         """
-        pass
+        Returns the number of parameters.
+        """
+        return self.linear.ncols()
+
+    def evaluate(self, parameters):
+        """
+        Returns for each of the tuples ``parameters`` the list of weights of ``self.elements``.
+        """
+        parameters = [list(t) for t in parameters]
+        n, m = self.space.dimension(), len(parameters)
+        T = matrix(QQ, m, self.ngens(), sum(parameters, [])).transpose()
+        images = self.linear * T + matrix(QQ, len(self.offset), m, [x for x in self.offset for _ in range(m)])
+        return [[self.space.from_vector(column[k * n:(k + 1) * n]) for k in range(len(self.elements))]
+                for column in images.columns()]
+
+    def __call__(self, t):
+        """
+        Returns the poset of weights at the parameters ``t``.
+        """
+        # ``relabel`` passes the underlying Weyl group elements
+        weights = dict(zip(self.elements, self.evaluate([t])[0]))
+        return self.poset.relabel(weights.__getitem__)
+
+    def symbolic_weights(self, names="t"):
+        """
+        Returns the list of weights of ``self.elements`` as vectors over a polynomial ring in the parameters.
+        """
+        R = PolynomialRing(QQ, names, self.ngens())
+        images = self.linear.change_ring(R) * vector(R, R.gens()) + self.offset
+        n = self.space.dimension()
+        return [images[k * n:(k + 1) * n] for k in range(len(self.elements))]
+
+    def __repr__(self):
+        return "Symbolic weight poset of %d elements with %d parameters" % (len(self.elements), self.ngens())
+
+
+class UnitarizableCone(object):
+    r"""
+    The unitarizable highest weights `\lambda` of a Hermitian symmetric pair with a given set
+    ``singular`` of compact simple roots orthogonal to `\lambda`.
+
+    Let `z = \langle \lambda + \rho, \beta^\vee \rangle` for the highest root `\beta`. By [EHW]_ a
+    weight `\lambda` with these singular roots, integral and dominant for the compact roots, is
+    unitarizable iff `z < A` or `z \in \{A, A + C, \dots, A + (r - 1) C = B\}`. The points
+    `A, \dots, B` are the reduction points of the line `\lambda + \mathbb{R} \zeta`.
+    """
+    def __init__(self, singular, B, C, r):
+        self.singular = singular
+        self.B = B
+        self.C = C
+        self.r = r
+        self.A = B - (r - 1) * C
+
+    def reduction_points(self):
+        return [self.A + j * self.C for j in range(self.r)]
+
+    def contains(self, z):
+        """
+        Returns whether the weights of ``self`` with `\\langle \\lambda + \\rho, \\beta^\\vee \\rangle = z` are unitarizable.
+        """
+        if z < self.A:
+            return True
+        if z > self.B:
+            return False
+        if self.C == 0:
+            return z == self.A
+        j = (z - self.A) / self.C
+        return j.is_integer()
+
+    def __repr__(self):
+        return "Unitarizable cone %s: z < %s or z in %s" % (self.singular, self.A, self.reduction_points())
+
+
+# the pair is handed to every worker process once by the pool initializer
+_sweep_pair = None
+
+
+def _init_sweep_worker(pair):
+    global _sweep_pair
+    _sweep_pair = pair
+
+
+def _sweep_worker(task):
+    method, v = task
+    return v, getattr(_sweep_pair, method)(v)
+
+
+def weight_box(pair, box):
+    r"""
+    Returns an iterator over the weights `\sum_i c_i \omega_i` of ``pair`` with ``c_i`` in ``box[i]``.
+    ``box`` is a list of iterables of coefficients, one for each fundamental weight.
+
+    EXAMPLES::
+
+        sage: P = HermitianSymmetricPair(["A", 3], [1, 3])
+        sage: list(weight_box(P, [[0], [-1, 0], [0]]))
+        [(-1, -1, 0, 0), (0, 0, 0, 0)]
+    """
+    fundamental_weights = [pair.ambient_space.fundamental_weight(i) for i in pair.ambient_space.index_set()]
+    for coefficients in itertools.product(*box):
+        yield sum((c * w for (c, w) in zip(coefficients, fundamental_weights)), pair.ambient_space.zero())
+
+
+def sweep(pair, weights=None, box=None, method="enright_cohomology", processes=None, ordered=True, chunksize=16):
+    """
+    Evaluates ``getattr(pair, method)`` on many weights in a pool of worker processes.
+
+    The weights are given either as an iterable ``weights`` or as a ``box``
+    (see ``weight_box``). Yields pairs ``(v, result)``, in the order of the
+    weights if ``ordered`` is true and as soon as they are finished otherwise.
+    The pair with its precomputed root data is sent to each worker only once,
+    and each worker keeps its own caches (see ``subsystem_signature``).
+
+    EXAMPLES::
+
+        sage: P = HermitianSymmetricPair(["A", 3], [1, 3])
+        sage: L = P.ambient_space
+        sage: weights = [-t * L.fundamental_weight(2) for t in range(4)]
+        sage: serial = [P.enright_cohomology(v) for v in weights]
+        sage: list(sweep(P, weights=weights, processes=2)) == list(zip(weights, serial))
+        True
+        sage: results = list(sweep(P, weights=weights, processes=2, ordered=False))
+        sage: len(results), all(H == serial[weights.index(v)] for (v, H) in results)
+        (4, True)
+        sage: box = [[0], range(-3, 1), [0]]
+        sage: [v for (v, H) in sweep(P, box=box, processes=2)] == list(weight_box(P, box))
+        True
+    """
+    if (weights is None) == (box is None):
+        raise ValueError("exactly one of weights and box has to be given")
+    if box is not None:
+        weights = weight_box(pair, box)
+    tasks = ((method, v) for v in weights)
+
+    pool = multiprocessing.Pool(processes, _init_sweep_worker, (pair,))
+    try:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for (v, result) in imap(_sweep_worker, tasks, chunksize):
+            yield v, result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()